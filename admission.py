@@ -0,0 +1,84 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+class AdmissionRejected(Exception):
+    """Raised when a provider's wait queue is full and the caller should retry later"""
+
+    def __init__(self, provider, retry_after):
+        super().__init__(f"{provider} is at capacity, retry after {retry_after}s")
+        self.provider = provider
+        self.retry_after = retry_after
+
+class ProviderLimiter:
+    """Cap concurrent calls to one provider, with a bounded queue of waiting callers"""
+
+    def __init__(self, name, max_concurrent, max_waiting, wait_timeout=10):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        # Moving average of call duration, used to estimate Retry-After
+        self.avg_duration = 1.0
+
+    def retry_after(self):
+        """Estimate how many seconds until a queued caller would be admitted"""
+        queued_rounds = (self.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(self.avg_duration * queued_rounds))
+
+    def _reject(self):
+        with self.lock:
+            self.rejected += 1
+            retry_after = self.retry_after()
+        raise AdmissionRejected(self.name, retry_after)
+
+    @contextmanager
+    def acquire(self, timeout=None):
+        """Hold one of the provider's slots for the duration of the block, waiting at most timeout seconds"""
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                queue_full = self.waiting >= self.max_waiting
+                if not queue_full:
+                    self.waiting += 1
+            if queue_full:
+                self._reject()
+            try:
+                wait_timeout = self.wait_timeout if timeout is None else min(self.wait_timeout, timeout)
+                admitted = self.slots.acquire(timeout=wait_timeout)
+            finally:
+                with self.lock:
+                    self.waiting -= 1
+            if not admitted:
+                self._reject()
+
+        with self.lock:
+            self.in_flight += 1
+            self.admitted += 1
+        started = time.time()
+        try:
+            yield
+        finally:
+            duration = time.time() - started
+            with self.lock:
+                self.in_flight -= 1
+                self.avg_duration = 0.8 * self.avg_duration + 0.2 * duration
+            self.slots.release()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'maxConcurrent': self.max_concurrent,
+                'maxWaiting': self.max_waiting,
+                'inFlight': self.in_flight,
+                'waiting': self.waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'avgDurationSeconds': round(self.avg_duration, 3)
+            }
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from admission import ProviderLimiter
+
+class SessionUser(UserMixin):
+    """The user fields requests need, detached from any database session so it can be cached"""
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(user.id, user.username, user.email)
+
+class UserCache:
+    """LRU cache with TTL of logged-in users, so authenticated requests skip the user query"""
+
+    def __init__(self, load_user, max_entries=10000, ttl_seconds=300):
+        self.load_user = load_user
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id):
+        """Return the SessionUser for user_id, loading it on a miss, or None if there is no such user"""
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and time.monotonic() - entry[1] <= self.ttl_seconds:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        user = self.load_user(user_id)
+        if user is None:
+            return None
+        session_user = SessionUser.from_user(user)
+        with self.lock:
+            self.entries[user_id] = (session_user, time.monotonic())
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return session_user
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self.entries),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl_seconds
+            }
+
+class PasswordHasher:
+    """Hash and check passwords with a cap on how many request threads may do so at once.
+
+    Password hashing is deliberately slow, so at most max_concurrent hashes run at once and
+    at most max_waiting more may wait, each for up to wait_timeout seconds. A burst of
+    ordinary sign-ins queues briefly; beyond that AdmissionRejected is raised, and a login
+    storm is turned away instead of tying up the threads that serve chat requests.
+    """
+
+    def __init__(self, method="scrypt", salt_length=16, max_concurrent=2, max_waiting=8, wait_timeout=2):
+        self.method = method
+        self.salt_length = salt_length
+        self.limiter = ProviderLimiter("password_hashing", max_concurrent, max_waiting, wait_timeout)
+
+    def _run(self, fn, *args, **kwargs):
+        # Hashing runs on the request thread; a pool would only add a thread for it to wait on
+        with self.limiter.acquire():
+            return fn(*args, **kwargs)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, method=self.method, salt_length=self.salt_length)
+
+    def check(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def snapshot(self):
+        return dict(self.limiter.snapshot(), method=self.method)
@@ -0,0 +1,69 @@
+"""Answer a JSONL file of symptom records offline, writing one JSONL result per record in input order.
+
+Each input line is an object like {"id": "intake-17", "symptoms": "..."}.
+
+Usage: python batch.py [input.jsonl] [-o results.jsonl]
+"""
+import argparse
+import json
+import sys
+from collections import deque
+from concurrent.futures import Future
+from itertools import islice
+
+def parse_jsonl(lines):
+    """Yield (record, error) per non-blank line, where error describes a line that is not a JSON object"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield None, f"Invalid JSON: {e}"
+            continue
+        if not isinstance(record, dict):
+            yield None, "Expected a JSON object"
+            continue
+        yield record, None
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+def completed(value):
+    """A Future that already holds value, for results that needed no pool work"""
+    future = Future()
+    future.set_result(value)
+    return future
+
+def in_order(batches, max_pending):
+    """Yield the results of batches of futures in submission order.
+
+    The next batch is only pulled once the oldest results are done or fewer than
+    max_pending are outstanding, so memory stays bounded however long the input is.
+    """
+    pending = deque()
+    for futures in batches:
+        pending.extend(futures)
+        while pending and (pending[0].done() or len(pending) > max_pending):
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', nargs='?', type=argparse.FileType('r', encoding='utf-8'), default=sys.stdin)
+    parser.add_argument('-o', '--output', type=argparse.FileType('w', encoding='utf-8'), default=sys.stdout)
+    args = parser.parse_args()
+
+    from main import create_app, process_batch
+    create_app()
+    for line in process_batch(args.input):
+        args.output.write(line)
+    args.output.flush()
+
+if __name__ == '__main__':
+    main()
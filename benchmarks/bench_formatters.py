@@ -0,0 +1,76 @@
+"""Micro-benchmarks for the response formatters and needs_more_info on large inputs.
+
+Usage: python benchmarks/bench_formatters.py [--lines 5000] [--repeat 5]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the app from reaching for real model servers while it is imported
+os.environ.update({
+    'INSTANCE_PATH': tempfile.mkdtemp(prefix='medibot-bench-'),
+    'OLLAMA_API_URL': 'http://127.0.0.1:9',
+    'OLLAMA_WARMUP': 'false',
+    'GEMINI_API_KEY': '',
+    'PROVIDER_PROBE_INTERVAL': '3600',
+    'LOG_LEVEL': 'ERROR',
+})
+
+from main import create_app, format_gemini_response, format_ollama_response, needs_more_info
+
+def strict_response(lines):
+    """An answer in our exact section format, with lines split across the three sections"""
+    per_section = max(1, lines // 3)
+    parts = ["POSSIBLE MEDICINES:"]
+    parts.extend(f"{i}. Medicine {i} (Brand {i}) - 200mg every 8 hours" for i in range(per_section))
+    parts.extend(["", "PRECAUTIONS:"])
+    parts.extend(f"- Precaution number {i}, take with food" for i in range(per_section))
+    parts.extend(["", "WHERE TO FIND:"])
+    parts.extend(f"- Pharmacy number {i}" for i in range(per_section))
+    return '\n'.join(parts)
+
+def unstructured_response(lines):
+    """A chatty markdown answer that ignored our format, so headers must be guessed"""
+    per_section = max(1, lines // 3)
+    parts = ["Here is some advice for you.", "", "**Recommended medications**"]
+    parts.extend(f"* Medicine {i} could help with the symptoms" for i in range(per_section))
+    parts.extend(["", "**Some warnings**"])
+    parts.extend(f"* Be careful with dose {i}" for i in range(per_section))
+    parts.extend(["", "**Where these are available**"])
+    parts.extend(f"* Shop {i} on the high street" for i in range(per_section))
+    return '\n'.join(parts)
+
+def symptom_text(words, vague):
+    """Free text with no vague words (a full scan), optionally with one at the very end"""
+    text = ' '.join(f"fever{i % 10} chills tiredness" for i in range(words // 3))
+    return text + (" and my stomach" if vague else "")
+
+def measure(label, fn, arg, repeat, size):
+    number = max(1, 2000 // max(1, size // 200))
+    best = min(timeit.repeat(lambda: fn(arg), number=number, repeat=repeat)) / number
+    print(f"{label:<44} {len(arg) / 1024:>9.1f} {best * 1e6:>12.1f} {len(arg) / best / 1e6:>10.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lines', type=int, default=5000, help='response lines for the formatter benchmarks')
+    parser.add_argument('--words', type=int, default=20000, help='words of symptom text for needs_more_info')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    # needs_more_info uses the triage vocabulary loaded with the app's services
+    create_app()
+
+    print(f"{'benchmark':<44} {'input KB':>9} {'us per call':>12} {'MB/s':>10}")
+    for lines in (30, args.lines):
+        measure(f"format_ollama_response ({lines} lines)", format_ollama_response, strict_response(lines), args.repeat, lines)
+        measure(f"format_gemini_response strict ({lines} lines)", format_gemini_response, strict_response(lines), args.repeat, lines)
+        measure(f"format_gemini_response loose ({lines} lines)", format_gemini_response, unstructured_response(lines), args.repeat, lines)
+    for words in (12, args.words):
+        measure(f"needs_more_info clear ({words} words)", needs_more_info, symptom_text(words, False), args.repeat, words)
+        measure(f"needs_more_info vague ({words} words)", needs_more_info, symptom_text(words, True), args.repeat, words)
+
+if __name__ == '__main__':
+    main()
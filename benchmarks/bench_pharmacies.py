@@ -0,0 +1,85 @@
+"""Benchmark building and querying the pharmacy KD-tree index on large synthetic datasets.
+
+Usage: python benchmarks/bench_pharmacies.py [--points 1000000] [--queries 5000] [--k 3]
+"""
+import argparse
+import heapq
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pharmacies import PharmacyIndex, build_index, to_unit_vector, chord_to_km
+
+HOURS = ["24/7", "Mo-Fr 08:00-20:00; Sa 09:00-17:00; Su off", "Mo-Su 07:00-02:00", "Mo-Sa 09:00-18:00", ""]
+
+def make_records(count, rng):
+    """Pharmacies clustered around random towns, as real ones are, plus a uniform rural scatter"""
+    towns = [(rng.uniform(-55, 65), rng.uniform(-170, 170), rng.uniform(0.02, 0.3)) for _ in range(max(1, count // 2000))]
+    for i in range(count):
+        if i % 10 == 0:
+            lat, lng = rng.uniform(-55, 65), rng.uniform(-180, 180)
+        else:
+            town_lat, town_lng, spread = rng.choice(towns)
+            lat = max(-89.9, min(89.9, rng.gauss(town_lat, spread)))
+            lng = (rng.gauss(town_lng, spread) + 180) % 360 - 180
+        yield f"Pharmacy {i}", f"{i} High Street", lat, lng, HOURS[i % len(HOURS)]
+
+def brute_force(points, lat, lng, k):
+    qx, qy, qz = to_unit_vector(lat, lng)
+    distances = ((sum((a - b) ** 2 for a, b in zip(point, (qx, qy, qz))), i) for i, point in enumerate(points))
+    return [chord_to_km(d ** 0.5) for d, _ in heapq.nsmallest(k, distances)]
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--points', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=5000)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--max-km', type=float, default=25.0)
+    parser.add_argument('--verify', type=int, default=5, help='queries to check against a linear scan')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    index_path = os.path.join(tempfile.mkdtemp(prefix='medibot-bench-'), 'pharmacies.idx')
+    records = list(make_records(args.points, rng))
+
+    started = time.perf_counter()
+    build_index(records, index_path)
+    print(f"build: {time.perf_counter() - started:.1f} s for {args.points} points, "
+          f"{os.path.getsize(index_path) / 1e6:.1f} MB on disk")
+
+    rss_before = max_rss_mb()
+    started = time.perf_counter()
+    index = PharmacyIndex(index_path)
+    print(f"open: {(time.perf_counter() - started) * 1000:.2f} ms (memory-mapped, "
+          f"max RSS grew {max_rss_mb() - rss_before:.0f} MB)")
+
+    # Query where people are: near a random pharmacy
+    queries = [(lat + rng.gauss(0, 0.01), lng + rng.gauss(0, 0.01))
+               for _, _, lat, lng, _ in rng.sample(records, min(args.queries, len(records)))]
+    open_at = datetime(2026, 10, 18, 23, 30)
+    for label, kwargs in (("k-nearest", {}), ("k-nearest open now", {'open_at': open_at})):
+        started = time.perf_counter()
+        found = sum(len(index.nearest(lat, lng, args.k, args.max_km, **kwargs)) for lat, lng in queries)
+        elapsed = time.perf_counter() - started
+        print(f"{label:<20} {elapsed / len(queries) * 1e6:>8.1f} us/query, {found / len(queries):.2f} results/query")
+
+    points = list(zip(index.xs, index.ys, index.zs))
+    for lat, lng in queries[:args.verify]:
+        expected = [d for d in brute_force(points, lat, lng, args.k) if d < args.max_km]
+        actual = [p.distance_km for p in index.nearest(lat, lng, args.k, args.max_km)]
+        assert [round(d, 6) for d in actual] == [round(d, 6) for d in expected], (lat, lng, actual, expected)
+    print(f"verified {min(args.verify, len(queries))} queries against a linear scan")
+    index.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark SimilarityCache lookup latency and hit rate as the number of stored prompts grows.
+
+Usage: python benchmarks/bench_similarity.py [--sizes 10000 100000 1000000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from similarity import SimilarityCache
+
+# Alphabetic made-up symptom terms, since the shingler only keeps letters
+SYMPTOM_WORDS = sorted({''.join(random.Random(i).choices('abcdefghijklmnopqrstuvwxyz', k=7)) for i in range(400)})
+FILLER_WORDS = ["and", "since", "yesterday", "with", "a", "bit", "of", "my", "for"]
+
+def make_prompt(rng, words):
+    words = list(words)
+    rng.shuffle(words)
+    filler = rng.sample(FILLER_WORDS, 2)
+    return ' '.join(words[:1] + filler[:1] + words[1:] + filler[1:])
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def run(size, queries, seed):
+    rng = random.Random(seed)
+    cache = SimilarityCache(":memory:", max_entries=size)
+    stored = []
+    started = time.perf_counter()
+    for _ in range(size):
+        words = rng.sample(SYMPTOM_WORDS, rng.randint(3, 6))
+        stored.append(words)
+        cache.add("gemini", make_prompt(rng, words), "POSSIBLE MEDICINES:\n- stored answer")
+    insert_seconds = time.perf_counter() - started
+
+    latencies = []
+    expected_hits = 0
+    hits = 0
+    for i in range(queries):
+        if i % 2 == 0:
+            # Paraphrase of a stored prompt: same symptoms, different order and filler
+            words = rng.choice(stored)
+            expected_hits += 1
+        else:
+            words = rng.sample(SYMPTOM_WORDS, rng.randint(3, 6))
+        prompt = make_prompt(rng, words)
+        started = time.perf_counter()
+        if cache.get("gemini", prompt) is not None:
+            hits += 1
+        latencies.append((time.perf_counter() - started) * 1e6)
+
+    cache.close()
+    return {
+        'size': size,
+        'insert_us': insert_seconds / size * 1e6,
+        'p50_us': percentile(latencies, 0.50),
+        'p99_us': percentile(latencies, 0.99),
+        'paraphrase_hit_rate': min(hits, expected_hits) / expected_hits,
+        'hits_per_query': hits / queries,
+        'max_rss_mb': max_rss_mb()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'entries':>10} {'insert us':>10} {'p50 us':>8} {'p99 us':>8} {'hit rate':>9} {'hits/query':>11} {'max rss MB':>11}")
+    for size in args.sizes:
+        result = run(size, args.queries, args.seed)
+        print(f"{result['size']:>10} {result['insert_us']:>10.1f} {result['p50_us']:>8.1f} {result['p99_us']:>8.1f} "
+              f"{result['paraphrase_hit_rate']:>9.1%} {result['hits_per_query']:>11.1%} {result['max_rss_mb']:>11.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark TriageClassifier against the original substring-scan needs_more_info as vocabularies grow.
+
+Usage: python benchmarks/bench_triage.py [--vocab-sizes 17 1000 5000] [--messages 2000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from triage import TriageClassifier
+
+ORIGINAL_TERMS = [
+    "pain", "ache", "hurt", "discomfort", "not feeling well",
+    "sick", "unwell", "bad", "weird", "strange", "odd",
+    "symptoms", "problem", "issue", "head", "stomach", "throat"
+]
+MESSAGE_WORDS = ("fever chills cough since yesterday evening and a runny nose with sneezing "
+                 "tiredness after meals dizzy when standing rash on my arm for three days").split()
+
+def legacy_needs_more_info(symptoms, vague_symptoms):
+    """The substring scan needs_more_info used before the triage module"""
+    if any(key in symptoms for key in ["Duration:", "Severity:", "Pattern:", "Original symptoms:"]):
+        return False
+    symptoms_lower = symptoms.lower()
+    for vague in vague_symptoms:
+        if vague in symptoms_lower:
+            return True
+    if len(symptoms.split()) < 4:
+        return True
+    return False
+
+def make_vocabulary(size, rng):
+    terms = list(ORIGINAL_TERMS)
+    while len(terms) < size:
+        terms.append(''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(5, 10))))
+    return terms
+
+def make_messages(count, rng):
+    # Mostly clear messages, which are the slow case since every term is tried
+    messages = [' '.join(rng.choices(MESSAGE_WORDS, k=rng.randint(6, 20))) for _ in range(count)]
+    for i in range(0, count, 5):
+        messages[i] += " and my stomach feels bad"
+    return messages
+
+def time_per_message(fn, messages):
+    started = time.perf_counter()
+    fn(messages)
+    return (time.perf_counter() - started) / len(messages) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--vocab-sizes', type=int, nargs='+', default=[17, 1000, 5000])
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = make_messages(args.messages, rng)
+    print(f"{'terms':>6} {'build ms':>9} {'legacy us':>10} {'compiled us':>12} {'batch us':>9} {'speedup':>8}")
+    for size in args.vocab_sizes:
+        terms = make_vocabulary(size, rng)
+        started = time.perf_counter()
+        classifier = TriageClassifier(terms)
+        build_ms = (time.perf_counter() - started) * 1000
+
+        legacy = time_per_message(lambda batch: [legacy_needs_more_info(m, terms) for m in batch], messages)
+        compiled = time_per_message(lambda batch: [classifier.needs_more_info(m) for m in batch], messages)
+        batched = time_per_message(classifier.needs_more_info_batch, messages)
+        assert classifier.needs_more_info_batch(messages) == [classifier.needs_more_info(m) for m in messages]
+        print(f"{size:>6} {build_ms:>9.1f} {legacy:>10.2f} {compiled:>12.2f} {batched:>9.2f} {legacy / compiled:>7.1f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""Drive /api/chat through the real Flask app against stub model servers and report latency per scenario.
+
+Scenarios: cache-cold, cache-warm, vague-symptom short-circuit, detailed-form and provider-down.
+Gemini is only exercised when google-generativeai is installed (pass --gemini).
+
+Usage: python benchmarks/load_test.py [--requests 200] [--concurrency 8] [--latency-ms 50]
+"""
+import argparse
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from werkzeug.serving import make_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from stub_servers import GeminiStubHandler, OllamaStubHandler, StubBehaviour, StubServer
+
+# Made-up alphabetic words: unknown to the knowledge base and to needs_more_info's vague word list
+WORDS = sorted({''.join(random.Random(i).choices('bcdfgklmnrstvz', k=3)) + ['ex', 'ia'][i % 2] for i in range(500)})
+PASSWORD = 'benchmark-password'
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def rss_mb():
+    """Resident memory right now, or None where /proc is missing (macOS).
+
+    ru_maxrss is no use per scenario: it is the process's peak so far and never goes down.
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return None
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+class RssSampler:
+    """Sample resident memory in the background to find the peak within one scenario"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = rss_mb()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='rss-sampler', daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            rss = rss_mb()
+            if rss is not None:
+                self.peak = max(self.peak, rss)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+def format_mb(value, width):
+    return f"{value:>{width}.0f}" if value is not None else f"{'n/a':>{width}}"
+
+def unique_symptoms(rng):
+    return f"I have {' and '.join(rng.sample(WORDS, 3))} since this morning"
+
+SCENARIOS = {
+    'cache-cold': unique_symptoms,
+    'cache-warm': lambda rng: "I have glorex and tamvia since this morning",
+    'vague-short-circuit': lambda rng: rng.choice(["my stomach hurts", "I feel sick", "head ache"]),
+    'detailed-form': lambda rng: (
+        f"Original symptoms: {unique_symptoms(rng)}\nDuration: {rng.randint(1, 9)} days\n"
+        f"Severity: {rng.randint(1, 6)}/10\nPattern: constant\nOther symptoms: none"
+    ),
+    # Same prompts as cache-cold, but with the model servers failing every request
+    'provider-down': unique_symptoms,
+}
+
+def configure_environment(args, ollama, gemini):
+    """Point the app at the stubs; must run before main is imported"""
+    instance_dir = tempfile.mkdtemp(prefix='medibot-bench-')
+    os.environ.update({
+        'INSTANCE_PATH': instance_dir,
+        'OLLAMA_API_URL': ollama.url,
+        'OLLAMA_WARMUP': 'false',
+        'LOG_LEVEL': 'WARNING',
+        'PROVIDER_PROBE_INTERVAL': '3600',
+        # The test server starts a thread per connection, so request threads never run out here
+        'WORKER_THREADS': str(args.concurrency * 8),
+        'OLLAMA_MAX_CONCURRENT': str(args.concurrency),
+        'LLM_MAX_WAITING': str(args.concurrency * 4),
+    })
+    if gemini:
+        os.environ.update({'GEMINI_API_KEY': 'benchmark-key', 'GEMINI_API_ENDPOINT': gemini.url})
+    else:
+        os.environ['GEMINI_API_KEY'] = ''
+    return instance_dir
+
+def start_app():
+    import main
+    from models import db, User
+
+    app = main.create_app()
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+    # Per-request access logs would dominate the measurement
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return main, server, f'http://127.0.0.1:{server.server_port}'
+
+def login(base_url):
+    session = requests.Session()
+    # Every client logs in at once when the run starts; at high concurrency some are told to come back
+    for _ in range(5):
+        response = session.post(f'{base_url}/login', data={'username': 'bench', 'password': PASSWORD}, allow_redirects=False)
+        if response.status_code != 503:
+            break
+        time.sleep(float(response.headers.get('Retry-After', 1)))
+    response.raise_for_status()
+    return session
+
+def run_scenario(name, base_url, args, seed):
+    make_prompt = SCENARIOS[name]
+    local = threading.local()
+    rng_lock = threading.Lock()
+    rng = random.Random(seed)
+    errors = []
+
+    def one_request(_):
+        if not hasattr(local, 'session'):
+            local.session = login(base_url)
+        with rng_lock:
+            symptoms = make_prompt(rng)
+        started = time.perf_counter()
+        response = local.session.post(f'{base_url}/api/chat', json={'symptoms': symptoms})
+        elapsed = (time.perf_counter() - started) * 1000
+        if response.status_code != 200:
+            errors.append(response.status_code)
+        return elapsed
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    with RssSampler() as sampler, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        latencies = list(pool.map(one_request, range(args.requests)))
+    wall = time.perf_counter() - started
+    rss_after = rss_mb()
+    return {
+        'scenario': name,
+        'rps': len(latencies) / wall,
+        'p50_ms': percentile(latencies, 0.50),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'errors': len(errors),
+        'rss_mb': rss_after,
+        'rss_growth_mb': rss_after - rss_before if rss_before is not None else None,
+        'peak_rss_mb': sampler.peak
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency-ms', type=float, default=50, help='stub time to first token')
+    parser.add_argument('--token-delay-ms', type=float, default=1)
+    parser.add_argument('--gemini', action='store_true', help='also start the Gemini stub and route to it first')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+
+    ollama = StubServer(OllamaStubHandler, StubBehaviour(args.latency_ms, args.token_delay_ms, seed=args.seed)).start()
+    gemini = None
+    if args.gemini:
+        gemini = StubServer(GeminiStubHandler, StubBehaviour(args.latency_ms, args.token_delay_ms, seed=args.seed)).start()
+    configure_environment(args, ollama, gemini)
+    app_module, server, base_url = start_app()
+
+    # Memory is the whole process (app, stubs and client threads) at the end of each scenario,
+    # how much that grew during it, and the highest value sampled while it ran
+    print(f"{'scenario':<20} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} "
+          f"{'rss MB':>7} {'grew MB':>8} {'peak MB':>8}")
+    try:
+        for name in args.scenarios:
+            stubs = [stub for stub in (ollama, gemini) if stub]
+            for stub in stubs:
+                stub.behaviour.failure_rate = 1.0 if name == 'provider-down' else 0.0
+            for provider in app_module.health_monitor.breakers:
+                app_module.health_monitor.record_success(provider)
+            result = run_scenario(name, base_url, args, args.seed)
+            print(f"{result['scenario']:<20} {result['rps']:>8.1f} {result['p50_ms']:>8.1f} {result['p95_ms']:>8.1f} "
+                  f"{result['p99_ms']:>8.1f} {result['errors']:>7} {format_mb(result['rss_mb'], 7)} "
+                  f"{format_mb(result['rss_growth_mb'], 8)} {format_mb(result['peak_rss_mb'], 8)}")
+    finally:
+        server.shutdown()
+        ollama.stop()
+        if gemini:
+            gemini.stop()
+
+if __name__ == '__main__':
+    main()
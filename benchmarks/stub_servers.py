@@ -0,0 +1,251 @@
+"""Local stand-ins for the Ollama HTTP API and the Gemini REST API, with configurable latency and failures.
+
+Run standalone to serve both until interrupted:
+    python benchmarks/stub_servers.py [--ollama-port 11434] [--gemini-port 8765] [--latency-ms 200]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+STUB_ANSWER = (
+    "POSSIBLE MEDICINES:\n"
+    "1. Paracetamol (Tylenol) - 500mg every 6 hours as needed\n"
+    "2. Ibuprofen (Advil) - 200mg every 8 hours with food\n"
+    "3. Cetirizine (Zyrtec) - 10mg once daily\n\n"
+    "PRECAUTIONS:\n"
+    "- Rest and stay hydrated\n"
+    "- Do not exceed the stated doses\n"
+    "- See a doctor if symptoms last more than three days\n\n"
+    "WHERE TO FIND:\n"
+    "- Local pharmacies\n"
+    "- Drug stores\n"
+    "- Supermarket pharmacy counters\n"
+)
+
+class StubBehaviour:
+    """Latency and failure settings shared by a stub server's handler threads; change them between scenarios"""
+
+    def __init__(self, latency_ms=200, token_delay_ms=5, chunk_chars=8, failure_rate=0.0,
+                 cold_load_ms=0, answer=STUB_ANSWER, seed=None):
+        self.latency_ms = latency_ms
+        self.token_delay_ms = token_delay_ms
+        self.chunk_chars = chunk_chars
+        self.failure_rate = failure_rate
+        # Reported as Ollama's load_duration on the first request only
+        self.cold_load_ms = cold_load_ms
+        self.answer = answer
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures = 0
+
+    def start_request(self):
+        """Count a request and return (should_fail, load_ms)"""
+        with self.lock:
+            self.requests += 1
+            load_ms = self.cold_load_ms if self.requests == 1 else 0
+            fail = self.rng.random() < self.failure_rate
+            if fail:
+                self.failures += 1
+        time.sleep((self.latency_ms + load_ms) / 1000)
+        return fail, load_ms
+
+    def chunks(self):
+        for start in range(0, len(self.answer), self.chunk_chars):
+            if self.token_delay_ms:
+                time.sleep(self.token_delay_ms / 1000)
+            yield self.answer[start:start + self.chunk_chars]
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            # Clients close pooled or cancelled connections at any point
+            pass
+
+    @property
+    def behaviour(self):
+        return self.server.behaviour
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def write_chunk(self, data):
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b'0\r\n\r\n')
+        self.wfile.flush()
+
+class OllamaStubHandler(StubHandler):
+    """Implements /api/tags and /api/generate, streaming newline-delimited JSON like Ollama"""
+
+    def do_GET(self):
+        if self.path.startswith('/api/tags'):
+            self.send_json(200, {'models': [{'name': 'medllama2:latest'}]})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if not self.path.startswith('/api/generate'):
+            self.send_json(404, {'error': 'not found'})
+            return
+        payload = self.read_json()
+        fail, load_ms = self.behaviour.start_request()
+        if fail:
+            self.send_json(500, {'error': 'injected failure'})
+            return
+        done = {
+            'model': payload.get('model'), 'response': '', 'done': True,
+            'context': [1, 2, 3, 4], 'load_duration': int(load_ms * 1e6)
+        }
+        if not payload.get('prompt'):
+            # An empty prompt only loads the model
+            self.send_json(200, done)
+            return
+        if not payload.get('stream', True):
+            num_predict = payload.get('options', {}).get('num_predict')
+            text = self.behaviour.answer if num_predict is None or num_predict > 1 else 'OK'
+            self.send_json(200, dict(done, response=text))
+            return
+        self.start_chunked('application/x-ndjson')
+        try:
+            for chunk in self.behaviour.chunks():
+                self.write_chunk((json.dumps({'response': chunk, 'done': False}) + '\n').encode('utf-8'))
+            self.write_chunk((json.dumps(done) + '\n').encode('utf-8'))
+            self.end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled generation by closing the connection
+            pass
+
+class GeminiStubHandler(StubHandler):
+    """Implements the v1beta REST calls made by google-generativeai with transport="rest" """
+
+    def candidate_response(self, text, int_enums):
+        return {
+            'candidates': [{
+                'content': {'parts': [{'text': text}], 'role': 'model'},
+                'finishReason': 1 if int_enums else 'STOP',
+                'index': 0
+            }]
+        }
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if '/models/' in path:
+            name = path.split('/models/', 1)[1]
+            self.send_json(200, {
+                'name': f'models/{name}', 'baseModelId': name, 'version': '001', 'displayName': name,
+                'description': 'Local stub model', 'inputTokenLimit': 30720, 'outputTokenLimit': 2048,
+                'supportedGenerationMethods': ['generateContent']
+            })
+        else:
+            self.send_json(404, {'error': {'code': 404, 'message': 'not found'}})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        int_enums = 'int' in ''.join(query.get('$alt', []) + query.get('alt', []))
+        self.read_json()
+        fail, _ = self.behaviour.start_request()
+        if fail:
+            self.send_json(500, {'error': {'code': 500, 'message': 'injected failure', 'status': 'INTERNAL'}})
+            return
+        if url.path.endswith(':generateContent'):
+            self.send_json(200, self.candidate_response(self.behaviour.answer, int_enums))
+            return
+        if not url.path.endswith(':streamGenerateContent'):
+            self.send_json(404, {'error': {'code': 404, 'message': 'not found'}})
+            return
+        sse = 'sse' in query.get('alt', [])
+        self.start_chunked('text/event-stream' if sse else 'application/json')
+        try:
+            # Without alt=sse the REST transport expects one JSON array, streamed element by element
+            if not sse:
+                self.write_chunk(b'[')
+            for index, chunk in enumerate(self.behaviour.chunks()):
+                body = json.dumps(self.candidate_response(chunk, int_enums))
+                if sse:
+                    self.write_chunk(f'data: {body}\r\n\r\n'.encode('utf-8'))
+                else:
+                    self.write_chunk((',' if index else '').encode('utf-8') + body.encode('utf-8'))
+            if not sse:
+                self.write_chunk(b']')
+            self.end_chunked()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+class StubServer:
+    """Run a stub handler on a local port in a background thread"""
+
+    def __init__(self, handler, behaviour=None, port=0):
+        self.behaviour = behaviour or StubBehaviour()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.behaviour = self.behaviour
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='stub-server', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ollama-port', type=int, default=11434)
+    parser.add_argument('--gemini-port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=200)
+    parser.add_argument('--token-delay-ms', type=float, default=5)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    servers = [
+        StubServer(handler, StubBehaviour(args.latency_ms, args.token_delay_ms, failure_rate=args.failure_rate), port)
+        for handler, port in ((OllamaStubHandler, args.ollama_port), (GeminiStubHandler, args.gemini_port))
+    ]
+    for server in servers:
+        server.start()
+    print(f"Ollama stub on {servers[0].url}, Gemini stub on {servers[1].url} (GEMINI_API_ENDPOINT={servers[1].url})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        for server in servers:
+            server.stop()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Fields sent by the detailed symptom form, see templates/index.html
+FORM_FIELDS = (
+    "original symptoms", "duration", "severity", "pattern",
+    "other symptoms", "previous medications", "triggers"
+)
+
+def normalize_symptoms(symptoms):
+    """Normalize a symptom prompt so equivalent requests share a cache key"""
+    free_text = []
+    form_fields = []
+    for line in symptoms.split('\n'):
+        line = ' '.join(line.lower().split())
+        if not line:
+            continue
+        key = line.split(':', 1)[0]
+        if ':' in line and key in FORM_FIELDS:
+            form_fields.append(line)
+        else:
+            free_text.append(line)
+    return '\n'.join(free_text + sorted(form_fields))
+
+def connect_shared(db_path, timeout=5.0):
+    """Open a SQLite connection that several worker processes can use on the same file at once"""
+    conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+    if db_path != ":memory:":
+        # WAL lets readers in other workers proceed while one worker writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class ResponseCache:
+    """LRU cache with TTL for model responses, persisted to SQLite.
+
+    The SQLite file is shared by all worker processes; each keeps its own in-memory LRU
+    in front of it and falls through to the file on a miss.
+    """
+
+    def __init__(self, db_path, max_entries=1024, ttl_seconds=24 * 60 * 60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        self.conn = connect_shared(db_path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS response_cache (
+                provider TEXT NOT NULL,
+                key TEXT NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (provider, key)
+            )"""
+        )
+        self.conn.execute("DELETE FROM response_cache WHERE created_at < ?", (time.time() - ttl_seconds,))
+        self.conn.commit()
+
+    @staticmethod
+    def make_key(prompt):
+        return hashlib.sha256(normalize_symptoms(prompt).encode('utf-8')).hexdigest()
+
+    def _expired(self, created_at):
+        return time.time() - created_at > self.ttl_seconds
+
+    def _remember(self, cache_key, response, created_at):
+        self.entries[cache_key] = (response, created_at)
+        self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, provider, prompt, count=True):
+        """Return the cached response for this provider and prompt, or None.
+
+        count=False leaves the hit and miss counters alone, for callers polling for an entry.
+        """
+        key = self.make_key(prompt)
+        cache_key = (provider, key)
+        with self.lock:
+            entry = self.entries.get(cache_key)
+            if entry is None:
+                row = self.conn.execute(
+                    "SELECT response, created_at FROM response_cache WHERE provider = ? AND key = ?",
+                    (provider, key)
+                ).fetchone()
+                if row:
+                    entry = (row[0], row[1])
+                    self._remember(cache_key, *entry)
+
+            if entry is None:
+                self.misses += count
+                return None
+
+            response, created_at = entry
+            if self._expired(created_at):
+                del self.entries[cache_key]
+                self.conn.execute("DELETE FROM response_cache WHERE provider = ? AND key = ?", (provider, key))
+                self.conn.commit()
+                self.evictions += 1
+                self.misses += count
+                return None
+
+            self.entries.move_to_end(cache_key)
+            self.hits += count
+            return response
+
+    def get_many(self, provider, prompts):
+        """Return cached responses (or None) for many prompts, reading all memory misses in one query"""
+        keys = [self.make_key(prompt) for prompt in prompts]
+        now = time.time()
+        with self.lock:
+            entries = {key: self.entries.get((provider, key)) for key in keys}
+            missing = [key for key, entry in entries.items() if entry is None]
+            # Stay under SQLite's default limit on bound parameters
+            for start in range(0, len(missing), 500):
+                chunk = missing[start:start + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, response, created_at FROM response_cache WHERE provider = ? "
+                    f"AND key IN ({','.join('?' * len(chunk))})",
+                    [provider, *chunk]
+                ).fetchall()
+                for key, response, created_at in rows:
+                    entries[key] = (response, created_at)
+                    self._remember((provider, key), response, created_at)
+
+            results = []
+            for key in keys:
+                entry = entries[key]
+                # Expired entries are left for get() to delete
+                if entry is None or now - entry[1] > self.ttl_seconds:
+                    self.misses += 1
+                    results.append(None)
+                else:
+                    self.entries.move_to_end((provider, key))
+                    self.hits += 1
+                    results.append(entry[0])
+            return results
+
+    def set(self, provider, prompt, response):
+        """Store a response for this provider and prompt"""
+        key = self.make_key(prompt)
+        created_at = time.time()
+        with self.lock:
+            self._remember((provider, key), response, created_at)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO response_cache (provider, key, response, created_at) VALUES (?, ?, ?, ?)",
+                (provider, key, response, created_at)
+            )
+            self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self.entries),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl_seconds
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
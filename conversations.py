@@ -0,0 +1,80 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ConversationStore:
+    """Ollama context arrays for in-progress conversations, with a TTL and a cap on stored tokens.
+
+    An entry holds the context returned by Ollama after it encoded the instruction template and
+    the user's original symptoms, so the follow-up turn only has to send the new details.
+    """
+
+    def __init__(self, ttl_seconds=30 * 60, max_total_tokens=2_000_000, max_context_tokens=4096):
+        self.ttl_seconds = ttl_seconds
+        self.max_total_tokens = max_total_tokens
+        self.max_context_tokens = max_context_tokens
+        self.entries = OrderedDict()
+        self.total_tokens = 0
+        self.prefix_context = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _remove(self, conversation_id):
+        entry = self.entries.pop(conversation_id, None)
+        if entry:
+            self.total_tokens -= len(entry['context'])
+
+    def put(self, conversation_id, context, symptoms):
+        """Remember the context that already encodes these original symptoms"""
+        if not context or len(context) > self.max_context_tokens:
+            return
+        with self.lock:
+            self._remove(conversation_id)
+            self.entries[conversation_id] = {
+                'context': list(context),
+                'symptoms': symptoms,
+                'created_at': time.time()
+            }
+            self.total_tokens += len(context)
+            while self.total_tokens > self.max_total_tokens:
+                oldest_id = next(iter(self.entries))
+                self._remove(oldest_id)
+                self.evictions += 1
+
+    def get(self, conversation_id):
+        """Return the stored entry for a conversation, or None if there is none or it expired"""
+        with self.lock:
+            entry = self.entries.get(conversation_id)
+            if entry and time.time() - entry['created_at'] > self.ttl_seconds:
+                self._remove(conversation_id)
+                self.evictions += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(conversation_id)
+            self.hits += 1
+            return entry
+
+    def discard(self, conversation_id):
+        with self.lock:
+            self._remove(conversation_id)
+
+    def set_prefix_context(self, context):
+        """Remember the context that encodes only the fixed instruction template"""
+        if context and len(context) <= self.max_context_tokens:
+            self.prefix_context = list(context)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'conversations': len(self.entries),
+                'storedTokens': self.total_tokens,
+                'maxTotalTokens': self.max_total_tokens,
+                'prefixWarm': self.prefix_context is not None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
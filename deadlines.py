@@ -0,0 +1,40 @@
+import math
+import time
+
+class DeadlineExceeded(Exception):
+    """Raised when a request's time budget runs out before an upstream call could finish"""
+
+class Deadline:
+    """A request's time budget, counted down on the monotonic clock and shared by every upstream call it makes"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.expires_at = time.monotonic() + seconds
+
+    @classmethod
+    def from_header(cls, value, default, maximum, minimum=0):
+        """Budget in seconds from a client header such as X-Request-Deadline, clamped to [minimum, maximum]"""
+        try:
+            seconds = float(value) if value else default
+        except ValueError:
+            seconds = default
+        if not math.isfinite(seconds) or seconds <= 0:
+            seconds = default
+        return cls(min(max(seconds, minimum), maximum))
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def allows(self, seconds):
+        """Whether enough budget is left to start an attempt expected to need at least this long"""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap=None):
+        """Seconds to give a blocking upstream call, raising DeadlineExceeded if nothing is left"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"{self.seconds:g}s request deadline exceeded")
+        return remaining if cap is None else min(cap, remaining)
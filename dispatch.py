@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from admission import AdmissionRejected
+
+logger = logging.getLogger(__name__)
+
+SEQUENTIAL = "sequential"
+HEDGED = "hedged"
+RACE = "race"
+DISPATCH_MODES = (SEQUENTIAL, HEDGED, RACE)
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+class ProviderStats:
+    """Win counts and latency samples for one provider"""
+
+    def __init__(self, max_samples=1000):
+        self.launched = 0
+        self.wins = 0
+        self.failures = 0
+        self.cancelled = 0
+        self.latencies = deque(maxlen=max_samples)
+
+    def snapshot(self):
+        samples = list(self.latencies)
+        return {
+            'launched': self.launched,
+            'wins': self.wins,
+            'failures': self.failures,
+            'cancelled': self.cancelled,
+            'p50Ms': percentile(samples, 0.50),
+            'p95Ms': percentile(samples, 0.95),
+            'p99Ms': percentile(samples, 0.99)
+        }
+
+class Dispatcher:
+    """Send a prompt to providers sequentially, hedged after a delay, or racing all at once"""
+
+    def __init__(self, mode=SEQUENTIAL, hedge_delay_ms=2000, max_workers=32, min_attempt_seconds=0):
+        if mode not in DISPATCH_MODES:
+            raise ValueError(f"Unknown dispatch mode {mode!r}, expected one of {', '.join(DISPATCH_MODES)}")
+        self.mode = mode
+        self.hedge_delay_ms = hedge_delay_ms
+        # A provider is not started once less than this much of the request's deadline is left
+        self.min_attempt_seconds = min_attempt_seconds
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="provider-dispatch")
+        self.stats = {}
+        self.hedges_fired = 0
+        self.deadline_exceeded = 0
+        self.skipped_for_deadline = 0
+        self.lock = threading.Lock()
+
+    def _stats(self, name):
+        if name not in self.stats:
+            self.stats[name] = ProviderStats()
+        return self.stats[name]
+
+    def _launch_delay(self):
+        """Seconds to wait on running providers before launching the next one"""
+        if self.mode == RACE:
+            return 0
+        if self.mode == HEDGED:
+            return self.hedge_delay_ms / 1000
+        return None
+
+    def _timed_call(self, name, call, cancel_event):
+        started = time.time()
+        result = call(cancel_event)
+        elapsed_ms = round((time.time() - started) * 1000, 1)
+        with self.lock:
+            if cancel_event.is_set():
+                self._stats(name).cancelled += 1
+            elif result:
+                self._stats(name).latencies.append(elapsed_ms)
+            else:
+                self._stats(name).failures += 1
+        return result
+
+    def dispatch(self, calls, accept, deadline=None):
+        """Run calls, a list of (name, call(cancel_event)) in preference order.
+
+        Returns (name, result) for the first result accepted by accept(result). If none is
+        accepted, the first non-empty result in preference order is returned instead, and
+        (None, None) if every provider failed. With a deadline, providers still running when
+        it expires are cancelled, and later ones are not started without enough budget left.
+        """
+        pending = list(calls)
+        running = {}
+        cancel_events = {}
+        results = {}
+        rejection = None
+        launch_delay = self._launch_delay()
+        last_launch = None
+
+        def launch_next():
+            nonlocal last_launch
+            name, call = pending.pop(0)
+            cancel_events[name] = threading.Event()
+            with self.lock:
+                self._stats(name).launched += 1
+            running[self.executor.submit(self._timed_call, name, call, cancel_events[name])] = name
+            last_launch = time.time()
+
+        try:
+            while pending or running:
+                # The first provider always gets the budget; a fallback only if enough is left
+                if pending and last_launch and deadline and not deadline.allows(self.min_attempt_seconds):
+                    with self.lock:
+                        self.skipped_for_deadline += len(pending)
+                    logger.info("Not starting %s, too little of the deadline is left",
+                                ', '.join(name for name, _ in pending))
+                    pending.clear()
+                    if not running:
+                        break
+                if not running:
+                    launch_next()
+                    continue
+                timeout = None
+                if pending and launch_delay is not None:
+                    timeout = max(0, launch_delay - (time.time() - last_launch))
+                if deadline:
+                    timeout = deadline.remaining() if timeout is None else min(timeout, deadline.remaining())
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done and deadline and deadline.expired():
+                    with self.lock:
+                        self.deadline_exceeded += 1
+                    logger.warning("Request deadline exceeded waiting for %s", ', '.join(running.values()))
+                    break
+                if not done:
+                    if not pending or launch_delay is None or time.time() - last_launch < launch_delay:
+                        # Woke for the deadline just before it expired; wait again
+                        continue
+                    # The hedge delay passed without an answer, so start the next provider too
+                    if self.mode == HEDGED:
+                        with self.lock:
+                            self.hedges_fired += 1
+                    launch_next()
+                    continue
+
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result = future.result()
+                    except AdmissionRejected as e:
+                        rejection = e
+                        continue
+                    except Exception as e:
+                        logger.error("%s dispatch error: %s", name, e)
+                        continue
+                    # Sequential keeps today's behavior and takes the first answer it gets
+                    if result and (self.mode == SEQUENTIAL or accept(result)):
+                        with self.lock:
+                            self._stats(name).wins += 1
+                        return name, result
+                    if result:
+                        results[name] = result
+        finally:
+            # Cancel whatever is still generating, the answer has already been chosen
+            for future, name in running.items():
+                cancel_events[name].set()
+                future.cancel()
+
+        for name, _ in calls:
+            if name in results:
+                with self.lock:
+                    self._stats(name).wins += 1
+                return name, results[name]
+        if rejection:
+            raise rejection
+        return None, None
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'hedgeDelayMs': self.hedge_delay_ms,
+                'hedgesFired': self.hedges_fired,
+                'deadlineExceeded': self.deadline_exceeded,
+                'skippedForDeadline': self.skipped_for_deadline,
+                'providers': {name: stats.snapshot() for name, stats in self.stats.items()}
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,151 @@
+import threading
+import time
+
+class CircuitBreaker:
+    """Track provider failures and stop routing traffic to a provider that keeps failing"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        """Return True if a request may be sent to the provider right now"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if time.time() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self.trial_in_flight = False
+            # Half-open: let a single trial request through
+            if self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def release_trial(self):
+        """End a half-open trial call that finished without a verdict (rejected, cancelled or out of time)"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def snapshot(self):
+        with self.lock:
+            retry_in = None
+            if self.state == self.OPEN:
+                retry_in = max(0.0, self.reset_timeout - (time.time() - self.opened_at))
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'failureThreshold': self.failure_threshold,
+                'retryInSeconds': retry_in
+            }
+
+class HealthMonitor:
+    """Probe providers in a background thread and feed the results into their circuit breakers"""
+
+    def __init__(self, interval=15, failure_threshold=3, reset_timeout=30):
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.probes = {}
+        self.status = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def register(self, name, probe):
+        """Register a provider with a probe callable that raises or returns False when unhealthy"""
+        self.breakers[name] = CircuitBreaker(name, self.failure_threshold, self.reset_timeout)
+        self.probes[name] = probe
+        self.status[name] = {'lastChecked': None, 'lastLatencyMs': None, 'lastError': None}
+
+    def is_available(self, name):
+        breaker = self.breakers.get(name)
+        return breaker is None or breaker.allow_request()
+
+    def state(self, name):
+        """Return the breaker state without counting it as a request"""
+        breaker = self.breakers.get(name)
+        return breaker.state if breaker else None
+
+    def record_success(self, name):
+        if name in self.breakers:
+            self.breakers[name].record_success()
+
+    def record_failure(self, name):
+        if name in self.breakers:
+            self.breakers[name].record_failure()
+
+    def release_trial(self, name):
+        if name in self.breakers:
+            self.breakers[name].release_trial()
+
+    def check(self, name):
+        """Run a single probe and record its outcome"""
+        started = time.time()
+        error = None
+        try:
+            healthy = self.probes[name]()
+        except Exception as e:
+            healthy = False
+            error = str(e)
+        if healthy:
+            self.record_success(name)
+        else:
+            self.record_failure(name)
+        self.status[name] = {
+            'lastChecked': time.time(),
+            'lastLatencyMs': round((time.time() - started) * 1000, 1),
+            'lastError': error if not healthy else None
+        }
+        return healthy
+
+    def run(self):
+        while not self.stop_event.is_set():
+            for name in list(self.probes):
+                self.check(name)
+            self.stop_event.wait(self.interval)
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="provider-health-monitor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout=self.interval)
+
+    def snapshot(self):
+        return {
+            name: dict(breaker.snapshot(), **self.status[name])
+            for name, breaker in self.breakers.items()
+        }
@@ -0,0 +1,98 @@
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class HistoryWriter:
+    """Write-behind queue for chat history.
+
+    Requests only enqueue rows; a background thread collects them for up to flush_interval
+    seconds and hands them to write_batch as {model: [row, ...]}, so many messages share
+    one transaction and one fsync. If the queue is full, rows are dropped rather than
+    making a request wait on the disk.
+    """
+
+    def __init__(self, write_batch, max_batch=500, flush_interval=0.5, max_queue=10000):
+        self.write_batch = write_batch
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failures = 0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def add(self, model, row):
+        """Queue a row for insertion without blocking"""
+        try:
+            self.queue.put_nowait((model, row))
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            logger.warning("History queue is full, dropping a %s row", model.__name__)
+
+    def _take_batch(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self.stop_event.is_set():
+                # On shutdown, take whatever is already queued without waiting for more
+                remaining = 0
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        rows = {}
+        for model, row in batch:
+            rows.setdefault(model, []).append(row)
+        try:
+            self.write_batch(rows)
+        except Exception:
+            logger.exception("Failed to write %d history rows", len(batch))
+            with self.lock:
+                self.failures += 1
+            return
+        with self.lock:
+            self.written += len(batch)
+            self.batches += 1
+
+    def run(self):
+        while not (self.stop_event.is_set() and self.queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                self._flush(batch)
+
+    def start(self):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="history-writer", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Write out what is still queued, waiting at most timeout seconds"""
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join(timeout)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'queued': self.queue.qsize(),
+                'written': self.written,
+                'dropped': self.dropped,
+                'batches': self.batches,
+                'failures': self.failures
+            }
@@ -0,0 +1,124 @@
+import json
+import math
+import re
+from collections import defaultdict
+
+TOKEN_PATTERN = re.compile(r"[a-z]+")
+SEVERITY_PATTERN = re.compile(r"severity:\s*(\d+)", re.IGNORECASE)
+
+# Words that carry no symptom meaning, including the labels of the detailed symptom form
+STOPWORDS = frozenset("""
+a an and are as at be been but by for from had has have i im in is it its me my of on or since so
+that the this to was were with after before during while when every can cant not feel feeling got
+really very some bit little lot today tonight yesterday morning evening day days week weeks hour hours
+original symptoms duration severity pattern constant intermittent progressive improving other previous
+medications triggers none
+""".split())
+
+def stem(token):
+    """Very small stemmer so that plurals match their singular form"""
+    if len(token) > 4 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+def tokenize(text):
+    return [stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+class KnowledgeBaseMatch:
+    def __init__(self, entry, confidence):
+        self.entry = entry
+        self.confidence = confidence
+
+    @property
+    def condition(self):
+        return self.entry['condition']
+
+    def to_text(self):
+        """Render the entry in the same section format the models are asked to produce"""
+        lines = ["POSSIBLE MEDICINES:"]
+        lines.extend(f"- {item}" for item in self.entry['medicines'])
+        lines.extend(["", "PRECAUTIONS:"])
+        lines.extend(f"- {item}" for item in self.entry['precautions'])
+        lines.extend(["", "WHERE TO FIND:"])
+        lines.extend(f"- {item}" for item in self.entry['locations'])
+        return '\n'.join(lines)
+
+class KnowledgeBase:
+    """Curated symptom to recommendation entries, searched through an inverted index of symptom terms"""
+
+    def __init__(self, entries, red_flags=(), max_severity=6):
+        self.entries = entries
+        self.red_flags = [set(tokenize(flag)) for flag in red_flags]
+        self.max_severity = max_severity
+        self.index = defaultdict(list)
+        self.entry_weights = []
+
+        entry_terms = [set(tokenize(' '.join(entry['symptoms']))) for entry in entries]
+        document_frequency = defaultdict(int)
+        for terms in entry_terms:
+            for term in terms:
+                document_frequency[term] += 1
+        # Rarer terms say more about which condition is meant
+        self.term_weights = {
+            term: math.log(1 + len(entries) / frequency)
+            for term, frequency in document_frequency.items()
+        }
+        # A term no entry mentions weighs as much as the rarest known one, so context the
+        # curated entries cannot account for (a child, other conditions, drugs) lowers confidence
+        self.unknown_term_weight = math.log(1 + len(entries))
+        for entry_id, terms in enumerate(entry_terms):
+            for term in terms:
+                self.index[term].append(entry_id)
+            self.entry_weights.append(sum(self.term_weights[term] for term in terms))
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['entries'], red_flags=data.get('red_flags', ()), **kwargs)
+
+    def is_unsafe(self, symptoms, terms):
+        """Red-flag symptoms and high severity always go to a model and a doctor, never to canned advice"""
+        if any(flag <= terms for flag in self.red_flags):
+            return True
+        severity = SEVERITY_PATTERN.search(symptoms)
+        return bool(severity) and int(severity.group(1)) > self.max_severity
+
+    def search(self, symptoms):
+        """Return the best KnowledgeBaseMatch for the symptoms, or None.
+
+        Confidence is an F0.5 score: it weighs how much of the query's terms the entry
+        explains twice as heavily as how much of the entry's profile is covered, since
+        people rarely list every symptom of a condition.
+        """
+        terms = set(tokenize(symptoms))
+        if not terms or self.is_unsafe(symptoms, terms):
+            return None
+
+        known_terms = [term for term in terms if term in self.index]
+        if not known_terms:
+            return None
+        query_weight = sum(self.term_weights.get(term, self.unknown_term_weight) for term in terms)
+
+        matched = defaultdict(float)
+        for term in known_terms:
+            for entry_id in self.index[term]:
+                matched[entry_id] += self.term_weights[term]
+
+        best_id, best_confidence = None, 0.0
+        for entry_id, weight in matched.items():
+            entry_coverage = weight / self.entry_weights[entry_id]
+            query_coverage = weight / query_weight
+            confidence = 1.25 * entry_coverage * query_coverage / (0.25 * query_coverage + entry_coverage)
+            if confidence > best_confidence:
+                best_id, best_confidence = entry_id, confidence
+        if best_id is None:
+            return None
+        return KnowledgeBaseMatch(self.entries[best_id], best_confidence)
+
+    def answer(self, symptoms, threshold):
+        """Return the best match if its confidence reaches the threshold"""
+        match = self.search(symptoms)
+        if match and match.confidence >= threshold:
+            return match
+        return None
@@ -0,0 +1,34 @@
+import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+class SamplingFilter(logging.Filter):
+    """Pass every warning and error, but only a random sample of debug and info records"""
+
+    def __init__(self, sample_rate=1.0):
+        super().__init__()
+        self.sample_rate = sample_rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.sample_rate
+
+def configure_logging(level="INFO", sample_rate=1.0):
+    """Route log records through a queue so request threads never wait on stdout.
+
+    Returns the started QueueListener; stop it on exit to flush the remaining records.
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    listener = QueueListener(queue.SimpleQueue(), handler)
+
+    queue_handler = QueueHandler(listener.queue)
+    # Sample before enqueueing, so dropped records cost nothing beyond the level check
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    root.handlers[:] = [queue_handler]
+    listener.start()
+    return listener
@@ -1,69 +1,504 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, flash, session, stream_with_context
 from flask_cors import CORS
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-import requests
+import atexit
+import hashlib
+import html
 import json
+import logging
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from datetime import datetime
+from functools import partial
+from zoneinfo import ZoneInfo
+import requests
 from dotenv import load_dotenv
-from models import db, User
+from sqlalchemy import event, insert, or_, select, tuple_
+from sqlalchemy.exc import IntegrityError
+from models import db, User, Conversation, Message, utcnow
+from cache import ResponseCache, normalize_symptoms
+from health import HealthMonitor
+from providers import OllamaClient, GeminiClient
+from admission import AdmissionRejected, ProviderLimiter
+from dispatch import Dispatcher
+from singleflight import SharedFlight, SingleFlight
+from response_parser import SECTION_HEADERS, MedicalResponse, SectionStreamParser, parse_response
+from knowledge_base import KnowledgeBase
+from triage import TriageClassifier
+from similarity import SimilarityCache
+from conversations import ConversationStore
+from warmup import ModelKeeper, parse_windows
+from pharmacies import PharmacyIndex
+from batch import chunked, completed, in_order, parse_jsonl
+from history import HistoryWriter
+from auth import PasswordHasher, UserCache
+from deadlines import Deadline, DeadlineExceeded
+from metrics import Registry, SIZE_BUCKETS
+from logs import configure_logging
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
+logger = logging.getLogger(__name__)
+
+OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
 
-# Configuration
-app.config['SECRET_KEY'] = 'your-secret-key-here'  # Change this to a secure secret key
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///medibot.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+def load_config(app):
+    """Read the app configuration from the environment"""
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')  # Change this to a secure secret key
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///medibot.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO')
+    app.config['LOG_SAMPLE_RATE'] = float(os.getenv('LOG_SAMPLE_RATE', 1.0))
+    app.config['RESPONSE_CACHE_SIZE'] = int(os.getenv('RESPONSE_CACHE_SIZE', 1024))
+    app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 24 * 60 * 60))
+    app.config['SIMILARITY_CACHE_SIZE'] = int(os.getenv('SIMILARITY_CACHE_SIZE', 100000))
+    app.config['SIMILARITY_THRESHOLD'] = float(os.getenv('SIMILARITY_THRESHOLD', 0.8))
+    app.config['COALESCE_LEASE_SECONDS'] = int(os.getenv('COALESCE_LEASE_SECONDS', 60))
+    app.config['PROVIDER_PROBE_INTERVAL'] = int(os.getenv('PROVIDER_PROBE_INTERVAL', 15))
+    app.config['BREAKER_FAILURE_THRESHOLD'] = int(os.getenv('BREAKER_FAILURE_THRESHOLD', 3))
+    app.config['BREAKER_RESET_TIMEOUT'] = int(os.getenv('BREAKER_RESET_TIMEOUT', 30))
+    app.config['OLLAMA_POOL_SIZE'] = int(os.getenv('OLLAMA_POOL_SIZE', 10))
+    app.config['OLLAMA_MAX_RETRIES'] = int(os.getenv('OLLAMA_MAX_RETRIES', 2))
+    app.config['OLLAMA_NUM_PREDICT'] = int(os.getenv('OLLAMA_NUM_PREDICT', 1000))
+    app.config['OLLAMA_WARMUP'] = os.getenv('OLLAMA_WARMUP', 'true').lower() == 'true'
+    app.config['OLLAMA_KEEP_ALIVE'] = int(os.getenv('OLLAMA_KEEP_ALIVE', 30 * 60))
+    app.config['OLLAMA_IDLE_KEEP_ALIVE'] = int(os.getenv('OLLAMA_IDLE_KEEP_ALIVE', 5 * 60))
+    app.config['OLLAMA_IDLE_WINDOWS'] = os.getenv('OLLAMA_IDLE_WINDOWS', '')
+    app.config['OLLAMA_KEEP_ALIVE_CHECK'] = int(os.getenv('OLLAMA_KEEP_ALIVE_CHECK', 60))
+    # Concurrent calls each provider is sized for: Gemini is a remote API that scales with us,
+    # a local Ollama server runs a couple of generations at a time. Beyond these, up to
+    # LLM_MAX_WAITING requests per provider wait a slot and the rest get a 503 with Retry-After.
+    # WORKER_THREADS is the server's request threads per process (gunicorn --threads); it should
+    # cover the slots and queue places, so that these limits and not the threads bound throughput
+    app.config['GEMINI_MAX_CONCURRENT'] = int(os.getenv('GEMINI_MAX_CONCURRENT', 8))
+    app.config['OLLAMA_MAX_CONCURRENT'] = int(os.getenv('OLLAMA_MAX_CONCURRENT', 2))
+    app.config['LLM_MAX_WAITING'] = int(os.getenv('LLM_MAX_WAITING', 4))
+    app.config['WORKER_THREADS'] = int(os.getenv('WORKER_THREADS', 16))
+    app.config['LLM_QUEUE_TIMEOUT'] = float(os.getenv('LLM_QUEUE_TIMEOUT', 10))
+    app.config['DISPATCH_MODE'] = os.getenv('DISPATCH_MODE', 'sequential')
+    app.config['HEDGE_DELAY_MS'] = int(os.getenv('HEDGE_DELAY_MS', 2000))
+    # Time budget for answering one request, across every provider it tries; clients may ask for
+    # between DEADLINE_MIN_ATTEMPT and MAX_REQUEST_DEADLINE seconds with an X-Request-Deadline header
+    app.config['REQUEST_DEADLINE'] = float(os.getenv('REQUEST_DEADLINE', 30))
+    app.config['MAX_REQUEST_DEADLINE'] = float(os.getenv('MAX_REQUEST_DEADLINE', 120))
+    app.config['DEADLINE_MIN_ATTEMPT'] = float(os.getenv('DEADLINE_MIN_ATTEMPT', 2))
+    app.config['OLLAMA_TIMEOUT'] = float(os.getenv('OLLAMA_TIMEOUT', 30))
+    app.config['KNOWLEDGE_BASE_PATH'] = os.getenv('KNOWLEDGE_BASE_PATH', os.path.join(app.root_path, 'data', 'knowledge_base.json'))
+    app.config['KB_CONFIDENCE_THRESHOLD'] = float(os.getenv('KB_CONFIDENCE_THRESHOLD', 0.7))
+    app.config['KB_FALLBACK_THRESHOLD'] = float(os.getenv('KB_FALLBACK_THRESHOLD', 0.35))
+    app.config['TRIAGE_VOCABULARY_PATH'] = os.getenv('TRIAGE_VOCABULARY_PATH', os.path.join(app.root_path, 'data', 'triage_vocabulary.json'))
+    app.config['CONVERSATION_TTL'] = int(os.getenv('CONVERSATION_TTL', 30 * 60))
+    app.config['CONVERSATION_MAX_TOKENS'] = int(os.getenv('CONVERSATION_MAX_TOKENS', 2_000_000))
+    app.config['PHARMACY_DATA_PATH'] = os.getenv('PHARMACY_DATA_PATH', '')
+    # IANA name, e.g. Europe/London: the opening hours in the dataset are local times there
+    app.config['PHARMACY_TIMEZONE'] = os.getenv('PHARMACY_TIMEZONE', '')
+    app.config['PHARMACY_RESULTS'] = int(os.getenv('PHARMACY_RESULTS', 3))
+    app.config['PHARMACY_MAX_KM'] = float(os.getenv('PHARMACY_MAX_KM', 25))
+    app.config['BATCH_MAX_WORKERS'] = int(os.getenv('BATCH_MAX_WORKERS', 4))
+    app.config['BATCH_CHUNK_SIZE'] = int(os.getenv('BATCH_CHUNK_SIZE', 64))
+    app.config['BATCH_MAX_PENDING'] = int(os.getenv('BATCH_MAX_PENDING', 256))
+    app.config['HISTORY_BATCH_SIZE'] = int(os.getenv('HISTORY_BATCH_SIZE', 500))
+    app.config['HISTORY_FLUSH_INTERVAL'] = float(os.getenv('HISTORY_FLUSH_INTERVAL', 0.5))
+    app.config['HISTORY_QUEUE_SIZE'] = int(os.getenv('HISTORY_QUEUE_SIZE', 10000))
+    app.config['HISTORY_PAGE_SIZE'] = int(os.getenv('HISTORY_PAGE_SIZE', 50))
+    app.config['HISTORY_MAX_PAGE_SIZE'] = int(os.getenv('HISTORY_MAX_PAGE_SIZE', 200))
+    app.config['USER_CACHE_SIZE'] = int(os.getenv('USER_CACHE_SIZE', 10000))
+    app.config['USER_CACHE_TTL'] = int(os.getenv('USER_CACHE_TTL', 300))
+    # Any werkzeug method string, e.g. "scrypt:32768:8:1" or "pbkdf2:sha256:600000"; existing hashes keep verifying
+    app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+    app.config['PASSWORD_SALT_LENGTH'] = int(os.getenv('PASSWORD_SALT_LENGTH', 16))
+    # Request threads that may hash at once; logins beyond that (plus any allowed to wait) get a 503
+    app.config['PASSWORD_HASH_MAX_CONCURRENT'] = int(os.getenv('PASSWORD_HASH_MAX_CONCURRENT', 2))
+    # A hash takes around 0.1 s, so the default queue clears well within the wait timeout
+    app.config['PASSWORD_HASH_MAX_WAITING'] = int(os.getenv('PASSWORD_HASH_MAX_WAITING', 8))
+    app.config['PASSWORD_HASH_WAIT_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_WAIT_TIMEOUT', 2))
 
-# Initialize extensions
-db.init_app(app)
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-OLLAMA_API_URL = "http://localhost:11434"
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-print(f"[DEBUG] GEMINI_API_KEY loaded: {'Yes' if GEMINI_API_KEY else 'No'}")
+# Prometheus metrics, served on /metrics. Each worker process reports its own.
+metrics = Registry()
+stage_seconds = metrics.histogram(
+    'medibot_stage_duration_seconds', 'Time spent in each request stage', ['stage'])
+provider_call_seconds = metrics.histogram(
+    'medibot_provider_call_duration_seconds', 'Duration of model provider calls', ['provider', 'outcome'])
+health_check_seconds = metrics.histogram(
+    'medibot_health_check_duration_seconds', 'Duration of background provider health probes', ['provider'])
+answers_total = metrics.counter(
+    'medibot_answers_total', 'Answers served, by the provider that produced them and where they came from',
+    ['provider', 'source'])
+provider_failures_total = metrics.counter(
+    'medibot_provider_failures_total', 'Provider calls that produced no usable answer', ['provider', 'reason'])
+prompt_bytes = metrics.histogram(
+    'medibot_prompt_bytes', 'Size of prompts sent to providers', ['provider'], buckets=SIZE_BUCKETS)
+response_bytes = metrics.histogram(
+    'medibot_response_bytes', 'Size of raw provider answers', ['provider'], buckets=SIZE_BUCKETS)
+deadline_exceeded_total = metrics.counter(
+    'medibot_deadline_exceeded_total',
+    'Requests that ran out of deadline: "fallback_skipped" when a fallback provider was not tried, '
+    '"no_answer" when no model answered in time', ['stage'])
+client_disconnects_total = metrics.counter(
+    'medibot_client_disconnects_total', 'Streaming requests whose client went away before the answer finished', ['route'])
+
+# The app built by create_app(); provider clients, caches and background workers below
+# belong to one process and are started by ensure_services() in every process that serves requests
+app = None
+log_listener = None
+response_cache = None
+similar_answers = None
+ollama_client = None
+gemini_client = None
+health_monitor = None
+model_keeper = None
+provider_limiters = {}
+dispatcher = None
+inflight_requests = None
+shared_requests = None
+knowledge_base = None
+triage = None
+conversations = None
+prewarm_executor = None
+batch_executor = None
+history_writer = None
+user_cache = None
+password_hasher = None
+pharmacy_index = None
+prefix_warming = threading.Lock()
+# When a pre-forking master loaded the Ollama model, so its workers do not each load it again
+model_preloaded_at = None
+# The process the services above were started in; a forked worker starts its own on first use
+services_pid = None
+services_lock = threading.Lock()
+# Services a forked worker inherited from its parent, kept referenced so that garbage
+# collection never closes the parent's SQLite connections from the child
+inherited_services = []
+
+def write_history(rows):
+    """Insert one batch of queued history rows in a single transaction"""
+    with app.app_context():
+        try:
+            # Conversations first, so their messages' foreign keys resolve
+            for model in (Conversation, Message):
+                if rows.get(model):
+                    db.session.execute(insert(model), rows[model])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+@health_check_seconds.time(provider="ollama")
+def probe_ollama():
+    """Check that the Ollama server is reachable"""
+    response = ollama_client.list_models(timeout=5)
+    return response.status_code == 200
+
+@health_check_seconds.time(provider="gemini")
+def probe_gemini():
+    """Check that the Gemini API accepts our key"""
+    return gemini_client.model_info() is not None
+
+def init_services(app):
+    """Create this process's provider clients, caches and background threads"""
+    global log_listener, response_cache, similar_answers, ollama_client, gemini_client, health_monitor
+    global model_keeper, provider_limiters, dispatcher, inflight_requests, shared_requests
+    global knowledge_base, triage, conversations, prewarm_executor, batch_executor, prefix_warming, pharmacy_index
+    global history_writer, user_cache, password_hasher
+
+    log_listener = configure_logging(app.config['LOG_LEVEL'], app.config['LOG_SAMPLE_RATE'])
+    logger.info("GEMINI_API_KEY loaded: %s", 'Yes' if GEMINI_API_KEY else 'No')
+
+    # Cache of raw model responses, keyed on provider and normalized symptoms
+    os.makedirs(app.instance_path, exist_ok=True)
+    response_cache = ResponseCache(
+        os.path.join(app.instance_path, 'response_cache.db'),
+        max_entries=app.config['RESPONSE_CACHE_SIZE'],
+        ttl_seconds=app.config['RESPONSE_CACHE_TTL']
+    )
+
+    # Answers for paraphrased symptoms, matched by MinHash similarity
+    similar_answers = SimilarityCache(
+        os.path.join(app.instance_path, 'similarity_cache.db'),
+        threshold=app.config['SIMILARITY_THRESHOLD'],
+        max_entries=app.config['SIMILARITY_CACHE_SIZE'],
+        ttl_seconds=app.config['RESPONSE_CACHE_TTL']
+    )
+
+    # Long-lived provider clients shared by all requests
+    ollama_client = OllamaClient(
+        OLLAMA_API_URL,
+        pool_size=app.config['OLLAMA_POOL_SIZE'],
+        max_retries=app.config['OLLAMA_MAX_RETRIES']
+    )
+    gemini_client = (
+        GeminiClient(GEMINI_API_KEY, api_endpoint=GEMINI_API_ENDPOINT)
+        if GeminiClient.is_supported(GEMINI_API_KEY) else None
+    )
+
+    # Background provider probes with a circuit breaker per provider
+    health_monitor = HealthMonitor(
+        interval=app.config['PROVIDER_PROBE_INTERVAL'],
+        failure_threshold=app.config['BREAKER_FAILURE_THRESHOLD'],
+        reset_timeout=app.config['BREAKER_RESET_TIMEOUT']
+    )
+    if gemini_client:
+        health_monitor.register("gemini", probe_gemini)
+    health_monitor.register("ollama", probe_ollama)
+    health_monitor.start()
+
+    # Preload MedLLama at startup and keep it resident outside the configured idle windows
+    model_keeper = ModelKeeper(
+        ollama_client,
+        keep_alive=app.config['OLLAMA_KEEP_ALIVE'],
+        idle_keep_alive=app.config['OLLAMA_IDLE_KEEP_ALIVE'],
+        idle_windows=parse_windows(app.config['OLLAMA_IDLE_WINDOWS']),
+        check_interval=app.config['OLLAMA_KEEP_ALIVE_CHECK']
+    )
+    if model_preloaded_at:
+        model_keeper.mark_warmed(model_preloaded_at)
+    model_keeper.start(warm_first=app.config['OLLAMA_WARMUP'] and not model_preloaded_at)
+
+    # Bounded concurrency per provider, so excess requests are turned away instead of piling up on worker threads
+    provider_limiters = {
+        "gemini": ProviderLimiter(
+            "gemini",
+            max_concurrent=app.config['GEMINI_MAX_CONCURRENT'],
+            max_waiting=app.config['LLM_MAX_WAITING'],
+            wait_timeout=app.config['LLM_QUEUE_TIMEOUT']
+        ),
+        "ollama": ProviderLimiter(
+            "ollama",
+            max_concurrent=app.config['OLLAMA_MAX_CONCURRENT'],
+            max_waiting=app.config['LLM_MAX_WAITING'],
+            wait_timeout=app.config['LLM_QUEUE_TIMEOUT']
+        )
+    }
+
+    # Requests normally hold one provider's slot or queue place at a time, so the busiest provider
+    # is what must fit in the request threads, with some left for requests that never reach a model
+    llm_positions = max(limiter.max_concurrent + limiter.max_waiting for limiter in provider_limiters.values())
+    if llm_positions >= app.config['WORKER_THREADS']:
+        logger.warning(
+            "Provider limits admit %d requests but there are only %d request threads; raise "
+            "WORKER_THREADS and --threads, or requests will wait for a thread instead of a provider",
+            llm_positions, app.config['WORKER_THREADS']
+        )
+
+    # Sequential, hedged or racing dispatch between providers
+    dispatcher = Dispatcher(
+        mode=app.config['DISPATCH_MODE'],
+        hedge_delay_ms=app.config['HEDGE_DELAY_MS'],
+        min_attempt_seconds=app.config['DEADLINE_MIN_ATTEMPT']
+    )
+
+    # Identical symptom queries that arrive while one is already generating share its answer,
+    # within this process and, through leases in a shared SQLite file, across worker processes
+    inflight_requests = SingleFlight()
+    shared_requests = SharedFlight(
+        os.path.join(app.instance_path, 'inflight.db'),
+        lease_seconds=app.config['COALESCE_LEASE_SECONDS']
+    )
+
+    # Curated answers for textbook cases, served locally without calling a model
+    knowledge_base = KnowledgeBase.load(app.config['KNOWLEDGE_BASE_PATH'])
+
+    # Vague-symptom vocabulary, compiled once into a single word-boundary regex
+    triage = TriageClassifier.load(app.config['TRIAGE_VOCABULARY_PATH'])
+
+    # Ollama contexts that already encode the instructions and a user's original symptoms
+    conversations = ConversationStore(
+        ttl_seconds=app.config['CONVERSATION_TTL'],
+        max_total_tokens=app.config['CONVERSATION_MAX_TOKENS']
+    )
+    prewarm_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ollama-prewarm")
+    prefix_warming = threading.Lock()
+
+    # Records from /api/chat/batch and batch.py that need a model; provider limits still apply on top
+    batch_executor = ThreadPoolExecutor(max_workers=app.config['BATCH_MAX_WORKERS'], thread_name_prefix="batch")
+
+    # Chat history is inserted in batches by a background thread, off the request path
+    history_writer = HistoryWriter(
+        write_history,
+        max_batch=app.config['HISTORY_BATCH_SIZE'],
+        flush_interval=app.config['HISTORY_FLUSH_INTERVAL'],
+        max_queue=app.config['HISTORY_QUEUE_SIZE']
+    )
+    history_writer.start()
+
+    # Logged-in users, kept so authenticated requests skip the user query
+    user_cache = UserCache(
+        lambda user_id: db.session.get(User, user_id),
+        max_entries=app.config['USER_CACHE_SIZE'],
+        ttl_seconds=app.config['USER_CACHE_TTL']
+    )
+
+    # Login and registration hashing, capped so it cannot starve chat requests
+    password_hasher = PasswordHasher(
+        method=app.config['PASSWORD_HASH_METHOD'],
+        salt_length=app.config['PASSWORD_SALT_LENGTH'],
+        max_concurrent=app.config['PASSWORD_HASH_MAX_CONCURRENT'],
+        max_waiting=app.config['PASSWORD_HASH_MAX_WAITING'],
+        wait_timeout=app.config['PASSWORD_HASH_WAIT_TIMEOUT']
+    )
+
+    # Optional local pharmacy dataset, compiled once into a KD-tree file that every worker memory-maps
+    pharmacy_index = None
+    if not app.config['PHARMACY_DATA_PATH']:
+        logger.debug("No PHARMACY_DATA_PATH set, only linking to Maps")
+    elif not os.path.exists(app.config['PHARMACY_DATA_PATH']):
+        logger.warning("No pharmacy dataset at %s, only linking to Maps", app.config['PHARMACY_DATA_PATH'])
+    else:
+        if not app.config['PHARMACY_TIMEZONE']:
+            logger.warning("PHARMACY_TIMEZONE is not set, so pharmacies are listed without opening status")
+        pharmacy_index = PharmacyIndex.load(
+            app.config['PHARMACY_DATA_PATH'],
+            os.path.join(app.instance_path, 'pharmacies.idx'),
+            ZoneInfo(app.config['PHARMACY_TIMEZONE']) if app.config['PHARMACY_TIMEZONE'] else None
+        )
 
-# Import Google Generative AI library
-try:
-    import google.generativeai as genai
-except ImportError:
-    print("Google Generative AI library not installed. Using fallback only.")
-    genai = None
+def preload_model(app):
+    """Load the Ollama model once, synchronously, in a master that is about to fork its workers.
+
+    Nothing is left running: the connection is closed before returning, so no worker inherits it.
+    """
+    global model_preloaded_at
+    client = OllamaClient(OLLAMA_API_URL, pool_size=1, max_retries=app.config['OLLAMA_MAX_RETRIES'])
+    keeper = ModelKeeper(
+        client,
+        keep_alive=app.config['OLLAMA_KEEP_ALIVE'],
+        idle_keep_alive=app.config['OLLAMA_IDLE_KEEP_ALIVE'],
+        idle_windows=parse_windows(app.config['OLLAMA_IDLE_WINDOWS'])
+    )
+    try:
+        load_ms = keeper.warm()
+        model_preloaded_at = time.time()
+        logger.info("Warmed up Ollama model %s before starting workers (load took %.0f ms)", client.model, load_ms)
+    except Exception as e:
+        logger.warning("Ollama warm-up failed, workers will retry it: %s", e)
+    finally:
+        client.close()
+
+def ensure_services():
+    """Start this process's services unless they are already running in it"""
+    global services_pid
+    if services_pid == os.getpid():
+        return
+    with services_lock:
+        if services_pid != os.getpid():
+            init_services(app)
+            services_pid = os.getpid()
+
+@atexit.register
+def shutdown_services():
+    """Stop background work and release provider connections on exit"""
+    if services_pid != os.getpid():
+        return
+    history_writer.stop()
+    health_monitor.stop()
+    model_keeper.stop()
+    dispatcher.shutdown()
+    prewarm_executor.shutdown(wait=False, cancel_futures=True)
+    batch_executor.shutdown(wait=False, cancel_futures=True)
+    ollama_client.close()
+    if gemini_client:
+        gemini_client.close()
+    response_cache.close()
+    similar_answers.close()
+    shared_requests.close()
+    if pharmacy_index:
+        pharmacy_index.close()
+    log_listener.stop()
+
+def reset_after_fork():
+    """Leave the parent's connections and threads behind in a forked worker, which starts its own on first use"""
+    global services_lock
+    # Locks a parent thread held at fork time would never be released in the child
+    services_lock = threading.Lock()
+    metrics.after_fork()
+    if app is None:
+        return
+    with app.app_context():
+        # Leave the parent's pooled database connections to the parent
+        db.engine.dispose(close=False)
+    if services_pid is not None:
+        inherited_services.append(
+            (response_cache, similar_answers, shared_requests, pharmacy_index, ollama_client, gemini_client)
+        )
+
+os.register_at_fork(after_in_child=reset_after_fork)
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Let worker processes read the user database while another one writes"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
+def create_app(config=None, start_services=True):
+    """Build the app and this process's services; services are module state, so one app per process.
+
+    A pre-forking master passes start_services=False: each worker then starts its own
+    services on its first request, and the master never holds connections or threads.
+    """
+    global app
+    # INSTANCE_PATH moves the SQLite databases and caches, e.g. for benchmark runs
+    app = Flask(__name__, instance_path=os.getenv('INSTANCE_PATH'))
+    CORS(app)
+    load_config(app)
+    if config:
+        app.config.update(config)
+
+    # Initialize extensions
+    db.init_app(app)
+    login_manager.init_app(app)
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', set_sqlite_pragmas)
+
+    register_routes(app)
+    app.before_request(ensure_services)
+    if start_services:
+        ensure_services()
+    return app
+
+BREAKER_STATE_VALUES = {"closed": 0, "half_open": 1, "open": 2}
+breaker_state = metrics.gauge(
+    'medibot_provider_breaker_state', 'Circuit breaker state: 0 closed, 1 half open, 2 open', ['provider'])
+provider_in_flight = metrics.gauge(
+    'medibot_provider_in_flight', 'Provider calls currently holding a concurrency slot', ['provider'])
+provider_waiting = metrics.gauge(
+    'medibot_provider_waiting', 'Provider calls queued for a concurrency slot', ['provider'])
+
+@metrics.add_collector
+def collect_provider_state():
+    for name in health_monitor.breakers:
+        breaker_state.set(BREAKER_STATE_VALUES[health_monitor.state(name)], provider=name)
+    for name, limiter in provider_limiters.items():
+        provider_in_flight.set(limiter.in_flight, provider=name)
+        provider_waiting.set(limiter.waiting, provider=name)
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
 
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def forget_cached_user(mapper, connection, target):
+    # Other workers' copies expire after USER_CACHE_TTL
+    if user_cache:
+        user_cache.invalidate(target.id)
+
+@stage_seconds.time(stage="needs_more_info")
 def needs_more_info(symptoms):
     """Check if we need more information based on the symptoms"""
-    # If it's already a detailed response from the form, don't ask for more info
-    if any(key in symptoms for key in ["Duration:", "Severity:", "Pattern:", "Original symptoms:"]):
-        return False
-        
-    # List of vague symptoms that need more details
-    vague_symptoms = [
-        "pain", "ache", "hurt", "discomfort", "not feeling well",
-        "sick", "unwell", "bad", "weird", "strange", "odd",
-        "symptoms", "problem", "issue", "head", "stomach", "throat"
-    ]
-    
-    symptoms_lower = symptoms.lower()
-    
-    # Check if the symptoms are too vague
-    for vague in vague_symptoms:
-        if vague in symptoms_lower:
-            return True
-            
-    # Check if the description is too short
-    if len(symptoms.split()) < 4:
-        return True
-        
-    return False
+    return triage.needs_more_info(symptoms)
 
 def create_medical_prompt(symptoms):
     # If this is a detailed form response, parse it differently
@@ -116,75 +551,63 @@ WHERE TO FIND:
 
 Keep your response focused and structured exactly as shown above, using bullet points (•) for each item."""
 
+RESPONSE_FORMAT_INSTRUCTIONS = """You are a medical assistant. Whenever you are given symptoms, you must respond in this exact format:\n\nPOSSIBLE MEDICINES:\n1. Medicine name (Brand name) - dosage and frequency\n2. Medicine name (Brand name) - dosage and frequency\n3. Medicine name (Brand name) - dosage and frequency\n\nPRECAUTIONS:\n- Safety step 1\n- Safety step 2\n- Safety step 3\n\nWHERE TO FIND:\n- Location 1\n- Location 2\n- Location 3\n\nDo not include any other text. Start directly with POSSIBLE MEDICINES:"""
+
+def create_symptoms_turn(prompt):
+    return f"Provide medical advice for: {prompt}\n\nStart directly with POSSIBLE MEDICINES:"
+
+def create_generation_prompt(prompt):
+    """Build the strict-format prompt sent to Gemini and Ollama"""
+    # The fixed instructions come first so Ollama can reuse their encoding across requests
+    return f"{RESPONSE_FORMAT_INSTRUCTIONS}\n\n{create_symptoms_turn(prompt)}"
+
+def location_coordinates(location):
+    """Return (lat, lng) from the browser's location, or None if it is missing or invalid"""
+    if not isinstance(location, dict):
+        return None
+    # The page sends lat/lng; latitude/longitude is accepted for API clients
+    try:
+        lat = float(location.get('lat', location.get('latitude')))
+        lng = float(location.get('lng', location.get('longitude')))
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
 def create_maps_link(location=None):
     """Create a Google Maps link for nearby pharmacies"""
     base_url = "https://www.google.com/maps/search/pharmacies"
-    if location and isinstance(location, dict) and 'latitude' in location and 'longitude' in location:
-        return f"{base_url}/@{location['latitude']},{location['longitude']},15z"
+    coordinates = location_coordinates(location)
+    if coordinates:
+        return f"{base_url}/@{coordinates[0]},{coordinates[1]},15z"
     return base_url
 
-def format_ollama_response(response_text, location=None):
-    """Format the Ollama response into HTML with our styling"""
-    # Split the response into sections
-    sections = {
-        "POSSIBLE MEDICINES:": "🏥",
-        "PRECAUTIONS:": "⚠️",
-        "WHERE TO FIND:": "🔍"
-    }
-    
-    html_response = '<div class="medical-response">'
-    
-    current_section = None
-    section_content = []
-    
-    for line in response_text.split('\n'):
-        line = line.strip()
-        if not line:
-            continue
-            
-        # Check if this line is a section header
-        is_header = False
-        for header in sections:
-            if header in line:
-                # If we were building a previous section, add it to the response
-                if current_section and section_content:
-                    html_response += f'''
-    <div class="response-section">
-        <h3>{sections[current_section]} {current_section}</h3>
-        <ul>
-'''
-                    for item in section_content:
-                        if item.strip():
-                            html_response += f'            <li>{item}</li>\n'
-                    html_response += '        </ul>\n    </div>\n'
-                
-                current_section = header
-                section_content = []
-                is_header = True
-                break
-                
-        if not is_header and current_section:
-            # Clean up the line
-            cleaned_line = line.strip('- ').strip()
-            if cleaned_line:
-                section_content.append(cleaned_line)
-    
-    # Add the last section
-    if current_section and section_content:
-        html_response += f'''
-    <div class="response-section">
-        <h3>{sections[current_section]} {current_section}</h3>
-        <ul>
-'''
-        for item in section_content:
-            if item.strip():
-                html_response += f'            <li>{item}</li>\n'
-        html_response += '        </ul>\n'
-        
-        # Add Google Maps link after WHERE TO FIND section
-        if current_section == "WHERE TO FIND:":
-            maps_link = create_maps_link(location)
-            html_response += f'''
+@stage_seconds.time(stage="pharmacies")
+def nearby_pharmacies(location):
+    """Closest pharmacies to the user from the local dataset, plus the closest open one if none of those are"""
+    coordinates = location_coordinates(location)
+    if pharmacy_index is None or coordinates is None:
+        return []
+    max_km = app.config['PHARMACY_MAX_KM']
+    results = pharmacy_index.nearest(*coordinates, k=app.config['PHARMACY_RESULTS'], max_km=max_km)
+    if results and pharmacy_index.timezone and not any(pharmacy.open_now for pharmacy in results):
+        results += pharmacy_index.nearest(*coordinates, k=1, max_km=max_km, open_at=pharmacy_index.local_time())
+    return results
+
+def where_to_find_items(items, location=None):
+    """Put the nearest known pharmacies ahead of the general advice in WHERE TO FIND"""
+    return [html.escape(pharmacy.describe()) for pharmacy in nearby_pharmacies(location)] + list(items)
+
+SECTION_ICONS = {
+    "POSSIBLE MEDICINES:": "🏥",
+    "PRECAUTIONS:": "⚠️",
+    "WHERE TO FIND:": "🔍"
+}
+
+def format_maps_link_html(location=None):
+    maps_link = create_maps_link(location)
+    return f'''
         <div class="maps-link">
             <a href="{maps_link}" target="_blank" class="google-maps-btn">
                 <img src="https://maps.google.com/mapfiles/ms/icons/red-dot.png" alt="Maps Icon" width="20" height="20">
@@ -192,169 +615,328 @@ def format_ollama_response(response_text, location=None):
             </a>
         </div>
 '''
-        html_response += '    </div>\n'
-    
-    html_response += '</div>'
-    return html_response
+
+def format_section_html(header, items, location=None):
+    """Render a single response section, adding nearby pharmacies and the maps link to WHERE TO FIND"""
+    if header == "WHERE TO FIND:":
+        items = where_to_find_items(items, location)
+    parts = [f'''
+    <div class="response-section">
+        <h3>{SECTION_ICONS[header]} {header}</h3>
+        <ul>
+''']
+    parts.extend(f'            <li>{item}</li>\n' for item in items if item.strip())
+    parts.append('        </ul>\n')
+
+    # Add Google Maps link after WHERE TO FIND section
+    if header == "WHERE TO FIND:":
+        parts.append(format_maps_link_html(location))
+    parts.append('    </div>\n')
+    return ''.join(parts)
+
+@stage_seconds.time(stage="format")
+def render_response_html(parsed, location=None):
+    """Render a parsed MedicalResponse into HTML with our styling"""
+    parts = ['<div class="medical-response">']
+    parts.extend(format_section_html(header, items, location) for header, items in parsed.sections())
+    parts.append('</div>')
+    return ''.join(parts)
+
+def format_ollama_response(response_text, location=None):
+    """Format the Ollama response into HTML with our styling"""
+    return render_response_html(parse_response(response_text, strict=True), location)
 
 def format_gemini_response(response_text, location=None):
-    """Format the Gemini response into HTML with our styling"""
-    # Ensure the response follows our expected format
-    if not response_text.startswith("POSSIBLE MEDICINES:"):
-        # If response doesn't start with our format, try to extract the relevant parts
-        sections = {
-            "POSSIBLE MEDICINES:": [],
-            "PRECAUTIONS:": [],
-            "WHERE TO FIND:": []
-        }
-        
-        # Simple parsing logic to extract sections from unstructured text
-        current_section = None
-        for line in response_text.split('\n'):
-            line = line.strip()
-            if not line:
-                continue
-                
-            # Check if this line is a section header
-            if "medicine" in line.lower() or "medication" in line.lower() or "treatment" in line.lower():
-                current_section = "POSSIBLE MEDICINES:"
-                continue
-            elif "precaution" in line.lower() or "warning" in line.lower() or "caution" in line.lower():
-                current_section = "PRECAUTIONS:"
-                continue
-            elif "find" in line.lower() or "location" in line.lower() or "available" in line.lower():
-                current_section = "WHERE TO FIND:"
-                continue
-                
-            if current_section and line:
-                # Clean up the line and add it to the appropriate section
-                cleaned_line = line.strip('- ').strip()
-                if cleaned_line:
-                    sections[current_section].append(cleaned_line)
-        
-        # Reconstruct the response in our expected format
-        formatted_response = "POSSIBLE MEDICINES:\n"
-        for item in sections["POSSIBLE MEDICINES:"] or ["Consult with a healthcare provider for specific medication recommendations"]:
-            formatted_response += f"- {item}\n"
-            
-        formatted_response += "\nPRECAUTIONS:\n"
-        for item in sections["PRECAUTIONS:"] or ["Monitor symptoms", "Rest and stay hydrated", "Seek medical attention if symptoms worsen"]:
-            formatted_response += f"- {item}\n"
-            
-        formatted_response += "\nWHERE TO FIND:\n"
-        for item in sections["WHERE TO FIND:"] or ["Local pharmacies", "Drug stores", "Consult healthcare provider"]:
-            formatted_response += f"- {item}\n"
-            
-        response_text = formatted_response
-    
-    # Use the existing format_ollama_response function since the format is the same
-    return format_ollama_response(response_text, location)
+    """Format the Gemini response into HTML, recovering sections if it ignored our format"""
+    return render_response_html(parse_response(response_text), location)
 
-def generate_gemini_response(prompt, location=None):
-    """Generate a response using the Gemini API"""
-    print(f"[DEBUG] Entered generate_gemini_response. GEMINI_API_KEY: {'set' if GEMINI_API_KEY else 'not set'}, genai: {'available' if genai else 'not available'}")
-    if not GEMINI_API_KEY or not genai:
-        print("[ERROR] Gemini API key not set or library not available")
+def failure_reason(error, deadline=None):
+    """Classify a provider exception into a low-cardinality metric label"""
+    # A timeout shortened to fit the request's deadline is the deadline's doing, not the provider's
+    if isinstance(error, DeadlineExceeded) or (deadline and deadline.expired()):
+        return "deadline"
+    if isinstance(error, requests.Timeout) or 'timeout' in type(error).__name__.lower():
+        return "timeout"
+    if isinstance(error, requests.ConnectionError):
+        return "connection"
+    if isinstance(error, requests.HTTPError):
+        return "http_error"
+    return "error"
+
+def generate_gemini_text(prompt, cancel_event=None, deadline=None):
+    """Generate raw response text using the Gemini API"""
+    if not gemini_client:
+        logger.error("Gemini API key not set or library not available")
         return None
     try:
-        genai.configure(api_key=GEMINI_API_KEY)
-        detailed_prompt = f"""Provide medical advice for: {prompt}\n\nYou must respond in this exact format:\n\nPOSSIBLE MEDICINES:\n1. Medicine name (Brand name) - dosage and frequency\n2. Medicine name (Brand name) - dosage and frequency\n3. Medicine name (Brand name) - dosage and frequency\n\nPRECAUTIONS:\n- Safety step 1\n- Safety step 2\n- Safety step 3\n\nWHERE TO FIND:\n- Location 1\n- Location 2\n- Location 3\n\nDo not include any other text. Start directly with POSSIBLE MEDICINES:"""
-        print("[DEBUG] Sending request to Gemini model...")
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        response = model.generate_content(detailed_prompt)
-        print(f"[DEBUG] Gemini API raw response: {getattr(response, 'text', str(response))[:500]}")
-        if response and hasattr(response, 'text'):
-            model_response = response.text.strip()
-            print(f"[DEBUG] Gemini response received: {model_response[:200]}...")
-            return format_gemini_response(model_response, location)
+        logger.debug("Sending request to Gemini model")
+        model_response = ''.join(stream_gemini_tokens(prompt, cancel_event, deadline)).strip()
+        if cancel_event and cancel_event.is_set():
+            logger.debug("Gemini request cancelled")
+            return None
+        if model_response:
+            logger.debug("Gemini response received (%d chars)", len(model_response))
+            return model_response
         else:
-            print("[ERROR] Empty or invalid response from Gemini")
+            logger.warning("Empty or invalid response from Gemini")
+            provider_failures_total.inc(provider="gemini", reason="empty_response")
             return None
     except Exception as e:
-        print(f"[ERROR] Gemini API error: {str(e)}")
+        logger.error("Gemini API error: %s", e)
+        provider_failures_total.inc(provider="gemini", reason=failure_reason(e, deadline))
         return None
 
-def get_model_response(prompt, location=None):
-    # First try using Gemini API
-    if GEMINI_API_KEY:
-        print("Attempting to use Gemini API...")
-        gemini_response = generate_gemini_response(prompt, location)
-        if gemini_response:
-            print("Successfully generated response with Gemini")
-            return gemini_response
-        else:
-            print("Gemini response failed, falling back to MedLLama...")
-    else:
-        print("No Gemini API key found, using MedLLama directly...")
+def generate_gemini_response(prompt, location=None):
+    """Generate a response using the Gemini API"""
+    model_response = generate_gemini_text(prompt)
+    if model_response:
+        return format_gemini_response(model_response, location)
+    return None
+
+def ensure_response_sections(model_response):
+    """Make sure an Ollama response contains all three expected sections"""
+    # If response doesn't start with our format, add it
+    if not model_response.startswith("POSSIBLE MEDICINES:"):
+        model_response = "POSSIBLE MEDICINES:\n" + model_response
+    
+    # Ensure all sections exist
+    if "PRECAUTIONS:" not in model_response:
+        model_response += "\n\nPRECAUTIONS:\n- Monitor symptoms\n- Rest and stay hydrated\n- Seek medical attention if symptoms worsen"
+    
+    if "WHERE TO FIND:" not in model_response:
+        model_response += "\n\nWHERE TO FIND:\n- Local pharmacies\n- Drug stores\n- Consult healthcare provider"
+    return model_response
+
+def generate_ollama_text(prompt, cancel_event=None, conversation_id=None, deadline=None):
+    """Generate raw response text using the local MedLLama model"""
+    logger.debug("Sending request to Ollama model")
     
-    # If Gemini fails or is not configured, fall back to MedLLama
     try:
-        print("Attempting to connect to Ollama...")
-        # First try Ollama API
-        response = requests.get(f"{OLLAMA_API_URL}/api/tags", timeout=5)
-        print(f"Ollama status check response: {response.status_code}")
-        
-        if response.status_code == 200:
-            # Use a more direct prompt style
-            detailed_prompt = f"""Provide medical advice for: {prompt}\n\nYou must respond in this exact format:\n\nPOSSIBLE MEDICINES:\n1. Medicine name (Brand name) - dosage and frequency\n2. Medicine name (Brand name) - dosage and frequency\n3. Medicine name (Brand name) - dosage and frequency\n\nPRECAUTIONS:\n- Safety step 1\n- Safety step 2\n- Safety step 3\n\nWHERE TO FIND:\n- Location 1\n- Location 2\n- Location 3\n\nDo not include any other text. Start directly with POSSIBLE MEDICINES:"""
-            
-            print("Sending request to Ollama model...")
-            
-            payload = {
-                "model": "medllama2",
-                "prompt": detailed_prompt,
-                "stream": False,
-                "temperature": 0.3,  # Lower temperature for more focused responses
-                "top_p": 0.9,
-                "max_tokens": 1000
-            }
-            
-            print("Payload:", payload)
-            
-            try:
-                response = requests.post(f"{OLLAMA_API_URL}/api/generate", json=payload, timeout=30)
-                print(f"Response status: {response.status_code}")
-                print(f"Response content: {response.text[:500]}")
-                
-                if response.status_code == 200:
-                    response_data = response.json()
-                    if isinstance(response_data, dict) and "response" in response_data:
-                        model_response = response_data["response"].strip()
-                        
-                        # If response doesn't start with our format, add it
-                        if not model_response.startswith("POSSIBLE MEDICINES:"):
-                            model_response = "POSSIBLE MEDICINES:\n" + model_response
-                        
-                        # Ensure all sections exist
-                        if "PRECAUTIONS:" not in model_response:
-                            model_response += "\n\nPRECAUTIONS:\n- Monitor symptoms\n- Rest and stay hydrated\n- Seek medical attention if symptoms worsen"
-                        
-                        if "WHERE TO FIND:" not in model_response:
-                            model_response += "\n\nWHERE TO FIND:\n- Local pharmacies\n- Drug stores\n- Consult healthcare provider"
-                        
-                        print(f"Formatted response: {model_response[:200]}")
-                        return format_ollama_response(model_response, location)
-                
-            except Exception as e:
-                print(f"Request error: {str(e)}")
+        model_response = ''.join(stream_ollama_tokens(prompt, cancel_event, conversation_id, deadline)).strip()
+        if cancel_event and cancel_event.is_set():
+            logger.debug("Ollama request cancelled")
+            return None
+        if model_response:
+            logger.debug("Ollama response received (%d chars)", len(model_response))
+            return model_response
+        provider_failures_total.inc(provider="ollama", reason="empty_response")
     
     except Exception as e:
-        print(f"Ollama API error: {str(e)}")
+        logger.error("Ollama API error: %s", e)
+        provider_failures_total.inc(provider="ollama", reason=failure_reason(e, deadline))
+    return None
+
+def has_required_sections(model_response):
+    """Check that a raw model answer contains all three response sections"""
+    return all(header in model_response for header in SECTION_HEADERS)
+
+def complete_response(provider, model_response):
+    """Fill in the sections a chosen Ollama answer left out; other providers' answers are parsed as they are"""
+    if provider == "ollama":
+        return ensure_response_sections(model_response)
+    return model_response
+
+def provider_available(provider):
+    """Whether the provider's circuit breaker lets a call through"""
+    if health_monitor.is_available(provider):
+        return True
+    logger.info("Skipping %s, circuit breaker is open", provider)
+    provider_failures_total.inc(provider=provider, reason="breaker_open")
+    return False
+
+@contextmanager
+def provider_slot(provider, prompt, deadline=None):
+    """Hold one of the provider's concurrency slots for a call, yielding the time the call started"""
+    try:
+        with provider_limiters[provider].acquire(timeout=deadline.remaining() if deadline else None):
+            prompt_bytes.observe(len(prompt.encode('utf-8')), provider=provider)
+            yield time.perf_counter()
+    except AdmissionRejected:
+        provider_failures_total.inc(provider=provider, reason="rejected")
+        raise
+    finally:
+        # A call that ends without a verdict (rejected, cancelled, out of time) must not keep holding
+        # a half-open breaker's single trial, or every request skips the provider until the next probe
+        health_monitor.release_trial(provider)
+
+def record_provider_answer(provider, prompt, model_response, started):
+    """Count a provider call that answered, close its breaker and cache the answer"""
+    provider_call_seconds.observe(time.perf_counter() - started, provider=provider, outcome="success")
+    response_bytes.observe(len(model_response.encode('utf-8')), provider=provider)
+    if not has_required_sections(model_response):
+        provider_failures_total.inc(provider=provider, reason="missing_sections")
+    health_monitor.record_success(provider)
+    cached_response = complete_response(provider, model_response)
+    response_cache.set(provider, prompt, cached_response)
+    similar_answers.add(provider, prompt, cached_response)
+
+def record_provider_failure(provider, started, deadline=None, reason=None):
+    """Count a provider call that ended without an answer, and hold it against the provider unless time ran out"""
+    provider_call_seconds.observe(time.perf_counter() - started, provider=provider, outcome="failure")
+    if reason:
+        provider_failures_total.inc(provider=provider, reason=reason)
+    # Running out of the client's time budget says nothing about the provider's health
+    if reason != "deadline" and not (deadline and deadline.expired()):
+        health_monitor.record_failure(provider)
 
-    print("All model responses failed, using fallback system...")
+def call_provider(provider, generate_text, prompt, cancel_event=None, deadline=None):
+    """Call one provider, respecting its circuit breaker, concurrency limit and the request deadline, and cache the answer"""
+    if not provider_available(provider):
+        return None
+    with provider_slot(provider, prompt, deadline) as started:
+        model_response = generate_text(prompt, cancel_event, deadline=deadline)
+        if cancel_event and cancel_event.is_set():
+            provider_call_seconds.observe(time.perf_counter() - started, provider=provider, outcome="cancelled")
+            return None
+        # The raw text goes back to the dispatcher so its accept check sees what the model wrote
+        if model_response:
+            record_provider_answer(provider, prompt, model_response, started)
+        else:
+            record_provider_failure(provider, started, deadline)
+        return model_response
+
+@stage_seconds.time(stage="parse")
+def parse_provider_response(provider, model_response):
+    """Parse a provider's raw answer into a MedicalResponse"""
+    # Ollama and knowledge base answers are already in our format, Gemini's may need their sections recovered
+    return parse_response(model_response, strict=None if provider == "gemini" else True)
+
+def answer_from_knowledge_base(prompt, threshold):
+    """Return ("knowledge_base", answer text) if a curated entry matches confidently enough"""
+    with stage_seconds.time(stage="knowledge_base"):
+        match = knowledge_base.answer(prompt, threshold)
+    if match:
+        logger.info("Answered from knowledge base: %s (confidence %.2f)", match.condition, match.confidence)
+        answers_total.inc(provider="knowledge_base", source="knowledge_base")
+        return "knowledge_base", match.to_text()
+    return None, None
+
+def cached_answer(providers, prompt, count=True):
+    """Return (provider, raw answer) from the response cache for the first provider that has one, or None"""
+    for provider, _ in providers:
+        cached_response = response_cache.get(provider, prompt, count=count)
+        if cached_response:
+            return provider, cached_response
+    return None
+
+def provider_chain(conversation_id=None):
+    """Return the (provider, generate_text) pairs to try: Gemini first, then MedLLama"""
+    providers = []
+    if gemini_client:
+        providers.append(("gemini", generate_gemini_text))
+    else:
+        logger.debug("No Gemini API key found, using MedLLama directly")
+    providers.append(("ollama", partial(generate_ollama_text, conversation_id=conversation_id)))
+    return providers
+
+def get_model_text(prompt, conversation_id=None, deadline=None):
+    """Return (provider, raw answer) from the knowledge base, the cache or the providers, or (None, None) if all failed"""
+    provider, model_response = answer_from_knowledge_base(prompt, app.config['KB_CONFIDENCE_THRESHOLD'])
+    if model_response:
+        return provider, model_response
+
+    providers = provider_chain(conversation_id)
+
+    cached = cached_answer(providers, prompt)
+    if cached:
+        logger.debug("Serving cached %s response", cached[0])
+        answers_total.inc(provider=cached[0], source="cache")
+        return cached
+
+    for provider, _ in providers:
+        cached_response = similar_answers.get(provider, prompt)
+        if cached_response:
+            logger.debug("Serving %s response from a similar earlier question", provider)
+            answers_total.inc(provider=provider, source="similar")
+            return provider, cached_response
+
+    calls = [
+        (provider, lambda cancel_event, provider=provider, generate_text=generate_text:
+            call_provider(provider, generate_text, prompt, cancel_event, deadline))
+        for provider, generate_text in providers
+    ]
+    # AdmissionRejected propagates when a busy provider is why nothing answered,
+    # so the client retries rather than settling for generic advice
+    dispatch = partial(dispatcher.dispatch, calls, accept=has_required_sections, deadline=deadline)
+    if deadline and deadline.seconds != app.config['REQUEST_DEADLINE']:
+        # A shared call runs on its leader's deadline, so one the client chose is not shared
+        provider, model_response = dispatch()
+    else:
+        flight_key = (tuple(provider for provider, _ in providers), normalize_symptoms(prompt))
+        shared_key = hashlib.sha256(repr(flight_key).encode('utf-8')).hexdigest()
+        # Threads in this worker wait on one call; other workers wait for its answer to reach the shared cache.
+        # Either way a follower gives up when its own deadline runs out.
+        provider, model_response = inflight_requests.do(
+            flight_key,
+            lambda: shared_requests.do(
+                shared_key,
+                dispatch,
+                # Polled every few ms while another worker holds the lease, so kept out of the hit rate
+                wait_for=lambda: cached_answer(providers, prompt, count=False),
+                timeout=deadline.remaining() if deadline else None
+            ),
+            timeout=deadline.remaining() if deadline else None,
+            default=(None, None)
+        )
+    if model_response:
+        logger.debug("Successfully generated response with %s", provider)
+        answers_total.inc(provider=provider, source="model")
+        return provider, complete_response(provider, model_response)
+
+    if deadline and deadline.expired():
+        deadline_exceeded_total.inc(stage="no_answer")
+    # With every model down, a looser knowledge base match still beats generic advice
+    return answer_from_knowledge_base(prompt, app.config['KB_FALLBACK_THRESHOLD'])
+
+def get_structured_response(prompt, conversation_id=None, deadline=None):
+    """Return (provider, MedicalResponse), where provider is "fallback" if no model answered"""
+    provider, model_response = get_model_text(prompt, conversation_id, deadline)
+    if model_response:
+        return provider, parse_provider_response(provider, model_response)
+    logger.warning("All model responses failed, using fallback system")
+    answers_total.inc(provider="fallback", source="fallback")
+    return "fallback", build_fallback_sections(prompt)
+
+def get_model_response(prompt, location=None, conversation_id=None, deadline=None):
+    """Return (provider, answer HTML), where provider is "fallback" if no model answered"""
+    provider, model_response = get_model_text(prompt, conversation_id, deadline)
+    if model_response:
+        return provider, render_response_html(parse_provider_response(provider, model_response), location)
+
+    logger.warning("All model responses failed, using fallback system")
+    answers_total.inc(provider="fallback", source="fallback")
     # If all attempts fail, use our fallback system
-    symptoms_lower = prompt.lower()
-    response_sections = {
-        "medicines": [],
-        "precautions": [],
-        "locations": []
-    }
+    return "fallback", build_fallback_response(prompt, location)
+
+GENERAL_PRECAUTIONS = [
+    "Monitor your symptoms and keep a log of any changes",
+    "If symptoms worsen or persist, seek medical attention",
+    "Stay hydrated and get adequate rest",
+    "Consider keeping a symptom diary to share with your healthcare provider"
+]
+
+# Default locations with map link placeholder
+FALLBACK_LOCATIONS = [
+    "Available at nearby pharmacies (click map link below)",
+    "Most medications available at major drugstore chains",
+    "Check 24-hour pharmacies for urgent needs",
+    "Consider pharmacy delivery services if needed",
+    "For prescription medications, consult with a healthcare provider first"
+]
+
+MORE_INFO_MESSAGE = "Please provide more details about your symptoms."
+
+FALLBACK_NOTE = "For your specific symptoms, it's recommended to consult with a healthcare provider for proper diagnosis and treatment. They can provide personalized medical advice and appropriate medication recommendations."
+
+@stage_seconds.time(stage="fallback")
+def build_fallback_sections(prompt):
+    """Build generic advice for when no model could answer, tailored to the detailed form if present"""
+    precautions = []
 
     # Parse the detailed form data if available
     form_data = {}
     if "Original symptoms:" in prompt:
-        lines = prompt.split('\n')
-        for line in lines:
+        for line in prompt.split('\n'):
             if ':' in line:
                 key, value = line.split(':', 1)
                 form_data[key.strip()] = value.strip()
@@ -363,64 +945,401 @@ def get_model_response(prompt, location=None):
     if form_data:
         severity = form_data.get("Severity", "").split('/')[0]
         if severity.isdigit() and int(severity) >= 7:
-            response_sections["precautions"].append("Given the high severity, consider seeking immediate medical attention")
+            precautions.append("Given the high severity, consider seeking immediate medical attention")
         
         duration = form_data.get("Duration", "")
         if any(word in duration.lower() for word in ["week", "month", "year"]):
-            response_sections["precautions"].append("Due to the long duration, consultation with a healthcare provider is recommended")
-
-    # Add default locations with map link placeholder
-    default_locations = [
-        "Available at nearby pharmacies (click map link below)",
-        "Most medications available at major drugstore chains",
-        "Check 24-hour pharmacies for urgent needs",
-        "Consider pharmacy delivery services if needed",
-        "For prescription medications, consult with a healthcare provider first"
-    ]
-    response_sections["locations"].extend(default_locations)
+            precautions.append("Due to the long duration, consultation with a healthcare provider is recommended")
+
+    return MedicalResponse(
+        medicines=[],
+        precautions=precautions + GENERAL_PRECAUTIONS,
+        locations=list(FALLBACK_LOCATIONS)
+    )
+
+def build_fallback_response(prompt, location=None):
+    """Build the generic advice shown when no model could answer"""
+    sections = build_fallback_sections(prompt)
 
     # Format the response in HTML with a note about consulting a healthcare provider
-    html_response = '<div class="medical-response">'
-    
-    html_response += '''
+    parts = [f'''<div class="medical-response">
     <div class="response-section">
         <h3>⚠️ IMPORTANT NOTE:</h3>
-        <p>For your specific symptoms, it\'s recommended to consult with a healthcare provider for proper diagnosis and treatment. They can provide personalized medical advice and appropriate medication recommendations.</p>
+        <p>{FALLBACK_NOTE}</p>
     </div>
 
     <div class="response-section">
         <h3>⚠️ GENERAL PRECAUTIONS:</h3>
         <ul>
-            <li>Monitor your symptoms and keep a log of any changes</li>
-            <li>If symptoms worsen or persist, seek medical attention</li>
-            <li>Stay hydrated and get adequate rest</li>
-            <li>Consider keeping a symptom diary to share with your healthcare provider</li>
-        </ul>
+''']
+    parts.extend(f'            <li>{item}</li>\n' for item in sections.precautions)
+    parts.append('''        </ul>
     </div>
 
     <div class="response-section">
         <h3>🔍 WHERE TO FIND HELP:</h3>
         <ul>
-'''
-    for location_item in set(response_sections["locations"]):
-        html_response += f'            <li>{location_item}</li>\n'
-    html_response += '        </ul>\n'
+''')
+    parts.extend(f'            <li>{location_item}</li>\n' for location_item in where_to_find_items(sections.locations, location))
+    parts.append('        </ul>\n')
     
     # Add Google Maps link
-    maps_link = create_maps_link(location)
-    html_response += f'''
-        <div class="maps-link">
-            <a href="{maps_link}" target="_blank" class="google-maps-btn">
-                <img src="https://maps.google.com/mapfiles/ms/icons/red-dot.png" alt="Maps Icon" width="20" height="20">
-                View Nearby Pharmacies on Google Maps
-            </a>
-        </div>
-'''
-    html_response += '    </div>\n</div>'
+    parts.append(format_maps_link_html(location))
+    parts.append('    </div>\n</div>')
+    return ''.join(parts)
+
+def stream_gemini_tokens(prompt, cancel_event=None, deadline=None):
+    """Yield text chunks from Gemini as they are generated, stopping early if cancelled"""
+    if not gemini_client:
+        return
+    response = gemini_client.generate_content(
+        create_generation_prompt(prompt), stream=True, timeout=deadline.timeout() if deadline else None
+    )
+    for chunk in response:
+        if cancel_event and cancel_event.is_set():
+            return
+        if deadline and deadline.expired():
+            raise DeadlineExceeded("Request deadline exceeded while Gemini was generating")
+        text = getattr(chunk, 'text', '')
+        if text:
+            yield text
+
+def original_symptoms_of(prompt):
+    """Return the original symptoms of a detailed form prompt, or None for a plain message"""
+    first_line = prompt.split('\n', 1)[0]
+    if first_line.startswith("Original symptoms:"):
+        return first_line.split(':', 1)[1].strip()
+    return None
+
+def build_ollama_payload(prompt, conversation_id=None, stream=True):
+    """Build the generate request, reusing an already-encoded context where we have one"""
+    payload = {
+        "model": ollama_client.model,
+        "stream": stream,
+        "keep_alive": model_keeper.keep_alive_seconds(),
+        "options": {
+            "temperature": 0.3,  # Lower temperature for more focused responses
+            "top_p": 0.9,
+            "num_predict": app.config['OLLAMA_NUM_PREDICT']
+        }
+    }
+    conversation = conversations.get(conversation_id) if conversation_id else None
+    if conversation and conversation['symptoms'] == original_symptoms_of(prompt):
+        # Instructions and original symptoms were encoded while the user filled in the form
+        details = prompt.split('\n', 1)[1] if '\n' in prompt else ''
+        payload["context"] = conversation['context']
+        payload["prompt"] = f"Additional details about these symptoms:\n{details}\n\nStart directly with POSSIBLE MEDICINES:"
+    elif conversations.prefix_context:
+        payload["context"] = conversations.prefix_context
+        payload["prompt"] = create_symptoms_turn(prompt)
+    else:
+        # While Ollama is failing, each request warming the prefix again would only add failing calls
+        if health_monitor.state("ollama") == "closed":
+            prewarm_executor.submit(warm_instruction_prefix)
+        payload["prompt"] = create_generation_prompt(prompt)
+    return payload
+
+def encode_ollama_context(prompt, context=None):
+    """Have Ollama encode a prompt, generating a single token, and return the resulting context.
+
+    This is background work, so it returns None rather than taking a half-open breaker's
+    trial call or waiting for one of Ollama's slots while requests are using them.
+    """
+    if health_monitor.state("ollama") != "closed":
+        return None
+    payload = {
+        "model": ollama_client.model,
+        "prompt": prompt,
+        "stream": False,
+        "keep_alive": model_keeper.keep_alive_seconds(),
+        "options": {"num_predict": 1}
+    }
+    if context:
+        payload["context"] = context
+    try:
+        with provider_limiters["ollama"].acquire(timeout=0):
+            started = time.time()
+            response = ollama_client.generate(payload, timeout=30)
+            response.raise_for_status()
+            result = response.json()
+    except AdmissionRejected:
+        logger.debug("Ollama is busy, skipping context encoding")
+        return None
+    except Exception:
+        health_monitor.record_failure("ollama")
+        raise
+    health_monitor.record_success("ollama")
+    model_keeper.record((time.time() - started) * 1000, result.get("load_duration"))
+    return result.get("context")
+
+def warm_instruction_prefix():
+    """Encode the fixed instruction template once so requests only send their symptoms"""
+    if conversations.prefix_context or not prefix_warming.acquire(blocking=False):
+        return
+    try:
+        context = encode_ollama_context(f"{RESPONSE_FORMAT_INSTRUCTIONS}\n\nReply only with OK.")
+        conversations.set_prefix_context(context)
+    except Exception as e:
+        logger.warning("Ollama prefix warm-up failed: %s", e)
+    finally:
+        prefix_warming.release()
+
+def prewarm_conversation(conversation_id, symptoms):
+    """Encode the original symptoms while the user fills in the detail form"""
+    try:
+        turn = f"Original symptoms: {symptoms}\nReply only with OK, more details will follow."
+        if conversations.prefix_context:
+            context = encode_ollama_context(turn, conversations.prefix_context)
+        else:
+            context = encode_ollama_context(f"{RESPONSE_FORMAT_INSTRUCTIONS}\n\n{turn}")
+        conversations.put(conversation_id, context, symptoms)
+    except Exception as e:
+        logger.warning("Ollama conversation prewarm failed: %s", e)
+
+def ollama_expected():
+    """Whether Ollama is likely to answer the follow-up turn, making a prewarm worthwhile"""
+    return (
+        gemini_client is None
+        or dispatcher.mode != "sequential"
+        or health_monitor.state("gemini") != "closed"
+    ) and health_monitor.state("ollama") == "closed"
+
+def stream_ollama_tokens(prompt, cancel_event=None, conversation_id=None, deadline=None):
+    """Yield text chunks from Ollama's streaming generate API, stopping early if cancelled"""
+    payload = build_ollama_payload(prompt, conversation_id)
+    started = time.time()
+    timeout = deadline.timeout(app.config['OLLAMA_TIMEOUT']) if deadline else app.config['OLLAMA_TIMEOUT']
+    with ollama_client.generate(payload, timeout=timeout, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            # Leaving the with block closes the connection, which stops generation on the server
+            if cancel_event and cancel_event.is_set():
+                return
+            if deadline and deadline.expired():
+                raise DeadlineExceeded("Request deadline exceeded while Ollama was generating")
+            if not line:
+                continue
+            chunk = json.loads(line)
+            if chunk.get("response"):
+                yield chunk["response"]
+            if chunk.get("done"):
+                model_keeper.record((time.time() - started) * 1000, chunk.get("load_duration"))
+                break
 
-    return html_response
+def start_conversation(symptoms):
+    """Remember this conversation and, if Ollama will answer it, encode its symptoms ahead of the follow-up"""
+    conversation_id = uuid.uuid4().hex
+    session['conversation_id'] = conversation_id
+    if ollama_expected():
+        prewarm_executor.submit(prewarm_conversation, conversation_id, symptoms.strip())
+    return conversation_id
+
+def record_conversation(conversation_id=None):
+    """Queue a new history conversation for the current user and return its id"""
+    conversation_id = conversation_id or uuid.uuid4().hex
+    history_writer.add(Conversation, {'id': conversation_id, 'user_id': current_user.id, 'created_at': utcnow()})
+    return conversation_id
+
+def record_message(conversation_id, role, content, provider=None):
+    """Queue a history message; it is written by the background writer, not in this request"""
+    history_writer.add(Message, {
+        'conversation_id': conversation_id,
+        'user_id': current_user.id,
+        'role': role,
+        'content': content,
+        'provider': provider,
+        'created_at': utcnow()
+    })
+
+def sse_event(event, data):
+    """Encode a single server-sent event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def read_sse_event(event):
+    """Split an event built by sse_event back into (event name, payload)"""
+    name_line, data_line = event.split('\n', 2)[:2]
+    return name_line[len("event: "):], json.loads(data_line[len("data: "):])
+
+def stream_model_response(prompt, location=None, conversation_id=None, deadline=None):
+    """Stream tokens and formatted sections, trying Gemini, then Ollama, then the fallback"""
+    providers = []
+    if gemini_client:
+        providers.append(("gemini", stream_gemini_tokens))
+    providers.append(("ollama", partial(stream_ollama_tokens, conversation_id=conversation_id)))
+    rejection = None
+    attempted = False
+
+    provider_name, kb_response = answer_from_knowledge_base(prompt, app.config['KB_CONFIDENCE_THRESHOLD'])
+    if kb_response:
+        parsed = parse_provider_response(provider_name, kb_response)
+        yield sse_event("answer", {"html": render_response_html(parsed, location)})
+        yield sse_event("done", {"provider": provider_name})
+        return
+
+    for provider_name, stream_tokens in providers:
+        cached_response = response_cache.get(provider_name, prompt) or similar_answers.get(provider_name, prompt)
+        if cached_response:
+            answers_total.inc(provider=provider_name, source="cache")
+            parsed = parse_provider_response(provider_name, cached_response)
+            yield sse_event("answer", {"html": render_response_html(parsed, location)})
+            yield sse_event("done", {"provider": provider_name, "cached": True})
+            return
+
+        # The first provider always gets the budget; a fallback only if enough is left
+        if attempted and deadline and not deadline.allows(app.config['DEADLINE_MIN_ATTEMPT']):
+            logger.info("Not starting %s, too little of the deadline is left", provider_name)
+            deadline_exceeded_total.inc(stage="fallback_skipped")
+            break
+
+        if not provider_available(provider_name):
+            continue
+        attempted = True
+
+        parser = SectionStreamParser()
+        response_text = ""
+        failed = False
+        try:
+            with provider_slot(provider_name, prompt, deadline) as started:
+                try:
+                    # closing() makes a client disconnect close the provider stream, and with it the upstream connection
+                    with closing(stream_tokens(prompt, deadline=deadline)) as tokens:
+                        for token in tokens:
+                            response_text += token
+                            yield sse_event("token", {"text": token})
+                            for header, items in parser.feed(token):
+                                yield sse_event("section", {"html": format_section_html(header, items, location)})
+                except GeneratorExit:
+                    provider_call_seconds.observe(time.perf_counter() - started, provider=provider_name, outcome="cancelled")
+                    raise
+                except Exception as e:
+                    logger.error("%s streaming error: %s", provider_name, e)
+                    record_provider_failure(provider_name, started, deadline, failure_reason(e, deadline))
+                    failed = True
+                else:
+                    if response_text.strip():
+                        record_provider_answer(provider_name, prompt, response_text.strip(), started)
+                    else:
+                        record_provider_failure(provider_name, started, deadline, "empty_response")
+        except AdmissionRejected as e:
+            rejection = e
+            continue
+
+        if failed and response_text:
+            # The client has part of an answer that will never be finished; have it drop that
+            # rather than pass the fragment off as complete, and move on to the next tier
+            yield sse_event("incomplete", {"provider": provider_name})
+        if failed or not response_text.strip():
+            continue
+
+        answers_total.inc(provider=provider_name, source="model")
+
+        completed = parser.finish()
+        if not parser.emitted:
+            # The model ignored our section format, so format the whole answer at once
+            yield sse_event("answer", {"html": format_gemini_response(response_text.strip(), location)})
+        for header, items in completed:
+            yield sse_event("section", {"html": format_section_html(header, items, location)})
+        yield sse_event("done", {"provider": provider_name})
+        return
+
+    if rejection:
+        yield sse_event("error", {'error': 'Service is busy, please retry shortly', 'retryAfter': rejection.retry_after})
+        return
+
+    if deadline and deadline.expired():
+        deadline_exceeded_total.inc(stage="no_answer")
+    provider_name, kb_response = answer_from_knowledge_base(prompt, app.config['KB_FALLBACK_THRESHOLD'])
+    if kb_response:
+        parsed = parse_provider_response(provider_name, kb_response)
+        yield sse_event("answer", {"html": render_response_html(parsed, location)})
+        yield sse_event("done", {"provider": provider_name})
+        return
+
+    logger.warning("All streaming providers failed, using fallback system")
+    answers_total.inc(provider="fallback", source="fallback")
+    yield sse_event("answer", {"html": build_fallback_response(prompt, location)})
+    yield sse_event("done", {"provider": "fallback"})
+
+def batch_result(index, record, **fields):
+    """One line of batch output, echoing the caller's id so results can be matched up"""
+    result = {'index': index}
+    if record and 'id' in record:
+        result['id'] = record['id']
+    result.update(fields)
+    return result
+
+def answer_batch_item(index, record):
+    """Answer one batch record through the normal provider chain, on the batch pool"""
+    try:
+        provider, parsed = get_structured_response(record['symptoms'], deadline=Deadline(app.config['REQUEST_DEADLINE']))
+    except AdmissionRejected as e:
+        return batch_result(index, record, status='busy', retryAfter=e.retry_after)
+    except Exception:
+        logger.exception("Batch item %d failed", index)
+        return batch_result(index, record, status='error', error='Could not answer these symptoms')
+    return batch_result(index, record, status='ok', provider=provider, response=parsed.to_dict())
+
+@stage_seconds.time(stage="batch_prepass")
+def prepare_batch(chunk):
+    """Answer what can be answered locally for a chunk of (index, (record, error)) pairs, and queue the rest.
+
+    Vagueness is checked with one triage scan and the cache with one query per provider,
+    so only records that really need a model reach the batch pool. Returns a future per record.
+    """
+    results = {}
+    todo = []
+    for index, (record, error) in chunk:
+        if error is None and not (isinstance(record.get('symptoms'), str) and record['symptoms'].strip()):
+            error = 'No symptoms provided'
+        if error:
+            results[index] = batch_result(index, record, status='invalid', error=error)
+        else:
+            todo.append((index, record))
+
+    vague = triage.needs_more_info_batch(record['symptoms'] for _, record in todo)
+    remaining = []
+    for (index, record), is_vague in zip(todo, vague):
+        if is_vague:
+            results[index] = batch_result(index, record, status='needs_more_info',
+                                          message=MORE_INFO_MESSAGE)
+            continue
+        provider, model_response = answer_from_knowledge_base(record['symptoms'], app.config['KB_CONFIDENCE_THRESHOLD'])
+        if model_response:
+            parsed = parse_provider_response(provider, model_response)
+            results[index] = batch_result(index, record, status='ok', provider=provider, response=parsed.to_dict())
+        else:
+            remaining.append((index, record))
+
+    for provider, _ in provider_chain():
+        if not remaining:
+            break
+        cached_responses = response_cache.get_many(provider, [record['symptoms'] for _, record in remaining])
+        still_remaining = []
+        for (index, record), cached_response in zip(remaining, cached_responses):
+            if cached_response:
+                answers_total.inc(provider=provider, source="cache")
+                parsed = parse_provider_response(provider, cached_response)
+                results[index] = batch_result(index, record, status='ok', provider=provider, response=parsed.to_dict())
+            else:
+                still_remaining.append((index, record))
+        remaining = still_remaining
+
+    futures = {index: completed(result) for index, result in results.items()}
+    for index, record in remaining:
+        futures[index] = batch_executor.submit(answer_batch_item, index, record)
+    return [futures[index] for index, _ in chunk]
+
+def process_batch(lines):
+    """Answer a JSONL stream of {"id", "symptoms"} records, yielding one JSON line per record in input order"""
+    chunks = chunked(enumerate(parse_jsonl(lines)), app.config['BATCH_CHUNK_SIZE'])
+    for result in in_order(map(prepare_batch, chunks), app.config['BATCH_MAX_PENDING']):
+        yield json.dumps(result) + '\n'
+
+def busy_signing_in(template, rejection):
+    """Re-show a sign-in form with a 503 when too many passwords are already being hashed"""
+    flash('Too many sign-ins right now, please try again in a moment')
+    return render_template(template), 503, {'Retry-After': str(rejection.retry_after)}
 
-@app.route('/register', methods=['GET', 'POST'])
 def register():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -435,25 +1354,36 @@ def register():
             flash('Passwords do not match')
             return redirect(url_for('register'))
         
-        if User.query.filter_by(username=username).first():
+        # One query for both unique columns, each answered from its own index
+        taken = db.session.execute(
+            select(User.username, User.email).where(or_(User.username == username, User.email == email)).limit(2)
+        ).all()
+        if any(row.username == username for row in taken):
             flash('Username already exists')
             return redirect(url_for('register'))
         
-        if User.query.filter_by(email=email).first():
+        if taken:
             flash('Email already registered')
             return redirect(url_for('register'))
         
-        user = User(username=username, email=email)
-        user.set_password(password)
+        try:
+            user = User(username=username, email=email, password_hash=password_hasher.hash(password))
+        except AdmissionRejected as e:
+            return busy_signing_in('register.html', e)
         db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Someone registered the same username or email since the check above
+            db.session.rollback()
+            flash('Username or email already registered')
+            return redirect(url_for('register'))
         
         flash('Registration successful! Please login.')
         return redirect(url_for('login'))
     
     return render_template('register.html')
 
-@app.route('/login', methods=['GET', 'POST'])
 def login():
     if current_user.is_authenticated:
         return redirect(url_for('index'))
@@ -463,7 +1393,11 @@ def login():
         password = request.form.get('password')
         user = User.query.filter_by(username=username).first()
         
-        if user and user.check_password(password):
+        try:
+            valid = user is not None and password_hasher.check(user.password_hash, password)
+        except AdmissionRejected as e:
+            return busy_signing_in('login.html', e)
+        if valid:
             login_user(user)
             return redirect(url_for('index'))
         else:
@@ -472,20 +1406,27 @@ def login():
     
     return render_template('login.html')
 
-@app.route('/logout')
 @login_required
 def logout():
     logout_user()
     return redirect(url_for('login'))
 
-@app.route('/')
 @login_required
 def index():
     return render_template('index.html')
 
-@app.route('/api/chat', methods=['POST'])
+def request_deadline():
+    """The time budget for this request, from the client's X-Request-Deadline header or the configured default"""
+    return Deadline.from_header(
+        request.headers.get('X-Request-Deadline'),
+        default=app.config['REQUEST_DEADLINE'],
+        minimum=app.config['DEADLINE_MIN_ATTEMPT'],
+        maximum=app.config['MAX_REQUEST_DEADLINE']
+    )
+
 @login_required
 def chat():
+    deadline = request_deadline()
     data = request.json
     symptoms = data.get('symptoms', '')
     location = data.get('location', None)
@@ -495,12 +1436,46 @@ def chat():
     
     # Check if we need more information only for initial symptoms
     if needs_more_info(symptoms) and "Original symptoms:" not in symptoms:
+        history_id = record_conversation(start_conversation(symptoms))
+        record_message(history_id, "user", symptoms)
+        record_message(history_id, "assistant", MORE_INFO_MESSAGE)
         return jsonify({
             'needsMoreInfo': True,
-            'message': 'Please provide more details about your symptoms.'
+            'message': MORE_INFO_MESSAGE
         })
     
-    response_text = get_model_response(symptoms, location)
+    # API clients that ask for JSON get the parsed sections without any HTML
+    wants_json = request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+    
+    conversation_id = session.pop('conversation_id', None)
+    # A follow-up joins the conversation its vague first message started
+    history_id = conversation_id or record_conversation()
+    record_message(history_id, "user", symptoms)
+    try:
+        if wants_json:
+            provider, parsed = get_structured_response(symptoms, conversation_id, deadline)
+            record_message(history_id, "assistant", json.dumps(parsed.to_dict()), provider)
+        else:
+            provider, response_text = get_model_response(symptoms, location, conversation_id, deadline)
+            record_message(history_id, "assistant", response_text, provider)
+    except AdmissionRejected as e:
+        response = jsonify({'error': 'Service is busy, please retry shortly', 'retryAfter': e.retry_after})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    finally:
+        # The follow-up turn has been answered, its prewarmed context is no longer needed
+        if conversation_id:
+            conversations.discard(conversation_id)
+    
+    if wants_json:
+        return jsonify({
+            'needsMoreInfo': False,
+            'provider': provider,
+            'response': parsed.to_dict(),
+            'mapsLink': create_maps_link(location),
+            'pharmacies': [pharmacy.to_dict() for pharmacy in nearby_pharmacies(location)]
+        })
     
     formatted_response = {
         'answer': response_text.strip() if response_text else "I apologize, but I couldn't process your symptoms properly. Please try again.",
@@ -509,9 +1484,121 @@ def chat():
     
     return jsonify(formatted_response)
 
+@login_required
+def chat_stream():
+    deadline = request_deadline()
+    data = request.json
+    symptoms = data.get('symptoms', '')
+    location = data.get('location', None)
+    
+    if not symptoms:
+        return jsonify({'error': 'No symptoms provided'}), 400
+    
+    if needs_more_info(symptoms) and "Original symptoms:" not in symptoms:
+        history_id = record_conversation(start_conversation(symptoms))
+        record_message(history_id, "user", symptoms)
+        record_message(history_id, "assistant", MORE_INFO_MESSAGE)
+        def needs_more_info_events():
+            yield sse_event("needsMoreInfo", {'message': MORE_INFO_MESSAGE})
+        return Response(needs_more_info_events(), mimetype='text/event-stream')
+    
+    conversation_id = session.pop('conversation_id', None)
+    history_id = conversation_id or record_conversation()
+    record_message(history_id, "user", symptoms)
+    def answer_events():
+        # The rendered HTML the client received, kept for the history
+        answer_html = []
+        try:
+            for event in stream_model_response(symptoms, location, conversation_id, deadline):
+                yield event
+                if event.startswith(("event: answer", "event: section", "event: incomplete", "event: done")):
+                    name, payload = read_sse_event(event)
+                    if name == "done":
+                        record_message(history_id, "assistant", ''.join(answer_html), payload['provider'])
+                    elif name == "incomplete":
+                        answer_html.clear()
+                    else:
+                        answer_html.append(payload['html'])
+        except GeneratorExit:
+            # The server closes the response when the client goes away; stop generating for it
+            client_disconnects_total.inc(route="stream")
+            raise
+        finally:
+            if conversation_id:
+                conversations.discard(conversation_id)
+    return Response(
+        stream_with_context(answer_events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@login_required
+def chat_batch():
+    # The body is read line by line while results stream back, so neither side is held in memory
+    return Response(stream_with_context(process_batch(request.stream)), mimetype='application/x-ndjson')
+
+@login_required
+def chat_history():
+    """The current user's messages, newest first, paginated by a (created_at, id) cursor instead of OFFSET"""
+    limit = request.args.get('limit', app.config['HISTORY_PAGE_SIZE'], type=int)
+    limit = max(1, min(limit, app.config['HISTORY_MAX_PAGE_SIZE']))
+    query = select(Message).where(Message.user_id == current_user.id)
+    before = request.args.get('before')
+    if before:
+        try:
+            created_at, message_id = before.rsplit('_', 1)
+            cursor = (datetime.fromisoformat(created_at), int(message_id))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        # A row-value comparison lets SQLite seek straight to the cursor in ix_message_user_created
+        query = query.where(tuple_(Message.created_at, Message.id) < cursor)
+    query = query.order_by(Message.created_at.desc(), Message.id.desc()).limit(limit)
+    messages = db.session.scalars(query).all()
+    next_cursor = None
+    if len(messages) == limit:
+        last = messages[-1]
+        next_cursor = f"{last.created_at.isoformat()}_{last.id}"
+    return jsonify({'messages': [message.to_dict() for message in messages], 'nextCursor': next_cursor})
+
+@login_required
+def cache_stats():
+    return jsonify({'exact': response_cache.stats(), 'similar': similar_answers.stats()})
+
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=Registry.CONTENT_TYPE)
+
+@login_required
+def provider_health():
+    providers = health_monitor.snapshot()
+    for name, limiter in provider_limiters.items():
+        if name in providers:
+            providers[name]['admission'] = limiter.snapshot()
+    return jsonify({
+        'providers': providers,
+        'dispatch': dispatcher.snapshot(),
+        'coalescing': dict(inflight_requests.snapshot(), acrossWorkers=shared_requests.snapshot()),
+        'conversations': conversations.stats(),
+        'ollamaModel': model_keeper.snapshot(),
+        'history': history_writer.snapshot(),
+        'users': dict(user_cache.stats(), passwordHashing=password_hasher.snapshot())
+    })
+
+def register_routes(app):
+    """Attach the views to the app; endpoint names are the view function names"""
+    app.add_url_rule('/register', view_func=register, methods=['GET', 'POST'])
+    app.add_url_rule('/login', view_func=login, methods=['GET', 'POST'])
+    app.add_url_rule('/logout', view_func=logout)
+    app.add_url_rule('/', view_func=index)
+    app.add_url_rule('/api/chat', view_func=chat, methods=['POST'])
+    app.add_url_rule('/api/chat/stream', view_func=chat_stream, methods=['POST'])
+    app.add_url_rule('/api/chat/batch', view_func=chat_batch, methods=['POST'])
+    app.add_url_rule('/api/history', view_func=chat_history)
+    app.add_url_rule('/api/cache/stats', view_func=cache_stats)
+    app.add_url_rule('/metrics', view_func=prometheus_metrics)
+    app.add_url_rule('/api/admin/providers', view_func=provider_health)
+
 if __name__ == '__main__':
+    app = create_app()
     with app.app_context():
-        if not os.path.exists('instance'):
-            os.makedirs('instance')
         db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
@@ -1,3 +1,4 @@
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -18,3 +19,36 @@ class User(UserMixin, db.Model):
 
     def __repr__(self):
         return f'<User {self.username}>'
+
+def utcnow():
+    """Current UTC time without tzinfo, the way SQLite returns stored datetimes"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class Conversation(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    __table_args__ = (db.Index('ix_conversation_user_created', 'user_id', 'created_at'),)
+
+class Message(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(db.String(32), db.ForeignKey('conversation.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    role = db.Column(db.String(16), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    provider = db.Column(db.String(32))
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    # Serves the newest-first, keyset-paginated history of one user
+    __table_args__ = (db.Index('ix_message_user_created', 'user_id', 'created_at', 'id'),)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'conversationId': self.conversation_id,
+            'role': self.role,
+            'content': self.content,
+            'provider': self.provider,
+            'createdAt': self.created_at.isoformat()
+        }
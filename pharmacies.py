@@ -0,0 +1,298 @@
+import csv
+import heapq
+import json
+import math
+import mmap
+import os
+import re
+import struct
+from array import array
+from datetime import datetime
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Points per KD-tree leaf; leaves are scanned linearly
+LEAF_SIZE = 8
+
+INDEX_MAGIC = b"MBPHARM1"
+# magic, point count, text blob size
+HEADER = struct.Struct("<8sQQ")
+
+DAYS = ("mo", "tu", "we", "th", "fr", "sa", "su")
+# A day's hours are (open, close) in minutes since midnight; close may run past 1440 into the next day
+CLOSED = -1
+UNKNOWN = -2
+HOURS_RULE = re.compile(r"^\s*([a-z, -]+?)\s+(off|closed|\d{1,2}:\d{2}\s*-\s*\d{1,2}:\d{2})\s*$")
+
+def parse_opening_hours(text):
+    """Parse hours like "Mo-Fr 08:00-20:00; Sa 09:00-13:00; Su off" or "24/7" into 7 (open, close) pairs"""
+    text = (text or '').strip().lower()
+    if not text:
+        return [(UNKNOWN, UNKNOWN)] * 7
+    if text == "24/7":
+        return [(0, 1440)] * 7
+    week = [(CLOSED, CLOSED)] * 7
+    for rule in text.split(';'):
+        if not rule.strip():
+            continue
+        match = HOURS_RULE.match(rule)
+        if not match:
+            raise ValueError(f"Unrecognized opening hours rule: {rule.strip()!r}")
+        days, hours = match.groups()
+        if hours in ("off", "closed"):
+            interval = (CLOSED, CLOSED)
+        else:
+            opens, closes = (_minutes(part) for part in hours.split('-'))
+            interval = (opens, closes if closes > opens else closes + 1440)
+        for day in _days(days):
+            week[day] = interval
+    return week
+
+def _minutes(clock):
+    hours, minutes = clock.strip().split(':')
+    return int(hours) * 60 + int(minutes)
+
+def _days(spec):
+    days = []
+    for part in spec.replace(' ', '').split(','):
+        first, _, last = part.partition('-')
+        start = DAYS.index(first)
+        end = DAYS.index(last) if last else start
+        days.extend(day % 7 for day in range(start, end + 1 + (7 if end < start else 0)))
+    return days
+
+def to_unit_vector(lat, lng):
+    """Point on the unit sphere, so straight-line distance orders points like great-circle distance"""
+    phi, lam = math.radians(lat), math.radians(lng)
+    return math.cos(phi) * math.cos(lam), math.cos(phi) * math.sin(lam), math.sin(phi)
+
+def chord_to_km(chord):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+def km_to_chord(km):
+    return 2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)
+
+def read_records(path):
+    """Yield (name, address, lat, lng, opening_hours) from a CSV or GeoJSON pharmacy file"""
+    if path.endswith(('.json', '.geojson')):
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        for feature in data['features']:
+            lng, lat = feature['geometry']['coordinates'][:2]
+            props = feature.get('properties', {})
+            yield props.get('name', ''), props.get('address', ''), float(lat), float(lng), props.get('opening_hours', '')
+    else:
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                yield row['name'], row.get('address', ''), float(row['lat']), float(row['lng']), row.get('opening_hours', '')
+
+def build_index(records, index_path):
+    """Write the records as an implicit KD-tree file that PharmacyIndex memory-maps"""
+    names, coords, lats, lngs, hours = [], ([], [], []), [], [], []
+    # Most pharmacies share a handful of schedules, so each distinct one is parsed once
+    parsed_hours = {}
+    for name, address, lat, lng, opening_hours in records:
+        names.append(f"{name}\x1f{address}".encode('utf-8'))
+        for axis, value in zip(coords, to_unit_vector(lat, lng)):
+            axis.append(value)
+        lats.append(lat)
+        lngs.append(lng)
+        week = parsed_hours.get(opening_hours)
+        if week is None:
+            week = parsed_hours[opening_hours] = sum(parse_opening_hours(opening_hours), ())
+        hours.append(week)
+
+    count = len(names)
+    order = list(range(count))
+    split_axes = bytearray(count)
+    # Each node is order[lo:hi], split at its median on the axis with the widest spread
+    stack = [(0, count)]
+    while stack:
+        lo, hi = stack.pop()
+        if hi - lo <= LEAF_SIZE:
+            continue
+        members = order[lo:hi]
+        # An evenly spaced sample is enough to pick the widest axis
+        sample = members[::max(1, len(members) // 64)]
+        spreads = [max(map(axis.__getitem__, sample)) - min(map(axis.__getitem__, sample)) for axis in coords]
+        axis = spreads.index(max(spreads))
+        members.sort(key=coords[axis].__getitem__)
+        order[lo:hi] = members
+        mid = (lo + hi) // 2
+        split_axes[mid] = axis
+        stack.append((lo, mid))
+        stack.append((mid + 1, hi))
+
+    text = bytearray()
+    text_offsets = array('q', [0])
+    for i in order:
+        text += names[i]
+        text_offsets.append(len(text))
+    week_hours = array('h')
+    for i in order:
+        week_hours.extend(hours[i])
+    sections = [array('d', (axis[i] for i in order)) for axis in coords]
+    sections += [array('d', (lats[i] for i in order)), array('d', (lngs[i] for i in order)), text_offsets]
+
+    # Write to a temporary file first, so workers never map a half-written index
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(INDEX_MAGIC, count, len(text)))
+        for section in sections:
+            f.write(section.tobytes())
+        f.write(week_hours.tobytes())
+        f.write(bytes(split_axes))
+        f.write(bytes(text))
+    os.replace(tmp_path, index_path)
+    return count
+
+class Pharmacy:
+    def __init__(self, name, address, lat, lng, distance_km, open_now=None):
+        self.name = name
+        self.address = address
+        self.lat = lat
+        self.lng = lng
+        self.distance_km = distance_km
+        self.open_now = open_now
+
+    def describe(self):
+        """One line for the WHERE TO FIND section"""
+        details = [f"{self.distance_km:.1f} km"]
+        if self.open_now is not None:
+            details.append("open now" if self.open_now else "closed now")
+        place = f"{self.name}, {self.address}" if self.address else self.name
+        return f"{place} ({', '.join(details)})"
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'address': self.address,
+            'lat': self.lat,
+            'lng': self.lng,
+            'distanceKm': round(self.distance_km, 2),
+            'openNow': self.open_now
+        }
+
+class PharmacyIndex:
+    """Nearest-pharmacy search over a memory-mapped KD-tree file.
+
+    Points are stored as unit vectors in KD-tree order, so a query walks the implicit tree
+    and only scans a few leaves. The file is mapped read-only, so every worker process
+    shares the same pages instead of holding its own copy.
+
+    Opening hours are local times in the dataset's timezone; without one, whether a
+    pharmacy is open is left unknown rather than judged by the server's clock.
+    """
+
+    def __init__(self, index_path, timezone=None):
+        self.timezone = timezone
+        with open(index_path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, text_size = HEADER.unpack_from(self.mmap)
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"{index_path} is not a pharmacy index")
+        self.count = count
+        self.view = memoryview(self.mmap)
+        offset = HEADER.size
+
+        def section(fmt, length, itemsize):
+            nonlocal offset
+            part = self.view[offset:offset + length * itemsize].cast(fmt)
+            offset += length * itemsize
+            return part
+
+        self.xs, self.ys, self.zs, self.lats, self.lngs = (section('d', count, 8) for _ in range(5))
+        self.text_offsets = section('q', count + 1, 8)
+        self.week_hours = section('h', count * 14, 2)
+        self.split_axes = section('B', count, 1)
+        self.text = section('B', text_size, 1)
+
+    @classmethod
+    def load(cls, source_path, index_path, timezone=None):
+        """Open the index for a CSV or GeoJSON file, rebuilding it when the source is newer"""
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(source_path):
+            build_index(read_records(source_path), index_path)
+        return cls(index_path, timezone)
+
+    def local_time(self):
+        """The current time where the pharmacies are, or None if the dataset has no timezone"""
+        return datetime.now(self.timezone) if self.timezone else None
+
+    def is_open(self, i, when):
+        minute = when.hour * 60 + when.minute
+        today = when.weekday()
+        base = i * 14
+        opens, closes = self.week_hours[base + today * 2], self.week_hours[base + today * 2 + 1]
+        if opens >= 0 and opens <= minute < closes:
+            return True
+        # Late-night hours from the day before
+        yesterday = base + (today - 1) % 7 * 2
+        return self.week_hours[yesterday] >= 0 and minute + 1440 < self.week_hours[yesterday + 1]
+
+    def has_hours(self, i):
+        return self.week_hours[i * 14] != UNKNOWN
+
+    def nearest(self, lat, lng, k=3, max_km=25.0, open_at=None):
+        """Return up to k pharmacies within max_km, closest first; with open_at, only those open then"""
+        if not self.count or k <= 0:
+            return []
+        if open_at is not None and open_at.tzinfo and self.timezone:
+            open_at = open_at.astimezone(self.timezone)
+        qx, qy, qz = to_unit_vector(lat, lng)
+        query = (qx, qy, qz)
+        axes = (self.xs, self.ys, self.zs)
+        xs, ys, zs = axes
+        limit = km_to_chord(max_km) ** 2
+        # Max-heap of the best k as (-squared chord, position)
+        best = []
+        worst = limit
+
+        def consider(i):
+            nonlocal worst
+            dx, dy, dz = xs[i] - qx, ys[i] - qy, zs[i] - qz
+            distance = dx * dx + dy * dy + dz * dz
+            if distance >= worst:
+                return
+            if open_at is not None and not self.is_open(i, open_at):
+                return
+            if len(best) < k:
+                heapq.heappush(best, (-distance, i))
+            else:
+                heapq.heapreplace(best, (-distance, i))
+            if len(best) == k:
+                worst = -best[0][0]
+
+        # Subtrees to visit, with the squared distance to their splitting plane as a lower bound
+        stack = [(0, self.count, 0.0)]
+        while stack:
+            lo, hi, bound = stack.pop()
+            if bound >= worst:
+                continue
+            if hi - lo <= LEAF_SIZE:
+                for i in range(lo, hi):
+                    consider(i)
+                continue
+            mid = (lo + hi) // 2
+            axis = self.split_axes[mid]
+            diff = query[axis] - axes[axis][mid]
+            consider(mid)
+            if diff < 0:
+                stack.append((mid + 1, hi, diff * diff))
+                stack.append((lo, mid, 0.0))
+            else:
+                stack.append((lo, mid, diff * diff))
+                stack.append((mid + 1, hi, 0.0))
+        results = []
+        now = open_at or self.local_time()
+        for negative_distance, i in sorted(best, reverse=True):
+            name, _, address = bytes(self.text[self.text_offsets[i]:self.text_offsets[i + 1]]).decode('utf-8').partition('\x1f')
+            open_now = self.is_open(i, now) if now and self.has_hours(i) else None
+            results.append(Pharmacy(name, address, self.lats[i], self.lngs[i],
+                                    chord_to_km(math.sqrt(-negative_distance)), open_now))
+        return results
+
+    def close(self):
+        for part in (self.xs, self.ys, self.zs, self.lats, self.lngs, self.text_offsets,
+                     self.week_hours, self.split_axes, self.text, self.view):
+            part.release()
+        self.mmap.close()
@@ -0,0 +1,81 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Import Google Generative AI library
+try:
+    import google.generativeai as genai
+except ImportError:
+    logger.warning("Google Generative AI library not installed. Using fallback only.")
+    genai = None
+
+class OllamaClient:
+    """Ollama HTTP client that reuses keep-alive connections from a shared pool"""
+
+    def __init__(self, base_url, model="medllama2", pool_size=10, max_retries=2):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.session = requests.Session()
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=0.2,
+            status_forcelist=(502, 503, 504)
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def list_models(self, timeout=5):
+        return self.session.get(f"{self.base_url}/api/tags", timeout=timeout)
+
+    def generate(self, payload, timeout=30, stream=False):
+        return self.session.post(f"{self.base_url}/api/generate", json=payload, timeout=timeout, stream=stream)
+
+    def close(self):
+        self.session.close()
+
+class GeminiClient:
+    """Gemini client that configures the SDK once and shares one model object across requests"""
+
+    def __init__(self, api_key, model_name='gemini-2.0-flash', api_endpoint=None):
+        self.api_key = api_key
+        self.model_name = model_name
+        # Alternative REST endpoint, e.g. a local stub server for benchmarks
+        self.api_endpoint = api_endpoint
+        self.model = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_supported(api_key):
+        return bool(api_key) and genai is not None
+
+    def get_model(self):
+        if self.model is None:
+            with self.lock:
+                if self.model is None:
+                    if self.api_endpoint:
+                        genai.configure(api_key=self.api_key, transport="rest",
+                                        client_options={"api_endpoint": self.api_endpoint})
+                    else:
+                        genai.configure(api_key=self.api_key)
+                    self.model = genai.GenerativeModel(self.model_name)
+        return self.model
+
+    def generate_content(self, prompt, timeout=None, **kwargs):
+        if timeout is not None:
+            # The SDK sets no timeout of its own
+            kwargs['request_options'] = {'timeout': timeout}
+        return self.get_model().generate_content(prompt, **kwargs)
+
+    def model_info(self):
+        self.get_model()
+        return genai.get_model(f'models/{self.model_name}')
+
+    def close(self):
+        with self.lock:
+            self.model = None
@@ -0,0 +1,146 @@
+import re
+from dataclasses import asdict, dataclass, field
+
+SECTION_HEADERS = ("POSSIBLE MEDICINES:", "PRECAUTIONS:", "WHERE TO FIND:")
+
+# Attribute of MedicalResponse that each section header fills
+SECTION_FIELDS = {
+    "POSSIBLE MEDICINES:": "medicines",
+    "PRECAUTIONS:": "precautions",
+    "WHERE TO FIND:": "locations"
+}
+
+DEFAULT_SECTION_ITEMS = {
+    "POSSIBLE MEDICINES:": ["Consult with a healthcare provider for specific medication recommendations"],
+    "PRECAUTIONS:": ["Monitor symptoms", "Rest and stay hydrated", "Seek medical attention if symptoms worsen"],
+    "WHERE TO FIND:": ["Local pharmacies", "Drug stores", "Consult healthcare provider"]
+}
+
+STRICT_HEADER_PATTERN = re.compile('|'.join(re.escape(header) for header in SECTION_HEADERS))
+
+# Keywords that mark a section header when the model ignored our format, checked in this order
+LOOSE_HEADER_PATTERNS = (
+    ("POSSIBLE MEDICINES:", re.compile(r'medicine|medication|treatment')),
+    ("PRECAUTIONS:", re.compile(r'precaution|warning|caution')),
+    ("WHERE TO FIND:", re.compile(r'find|location|available'))
+)
+
+@dataclass
+class MedicalResponse:
+    """Model answer split into its three sections"""
+    medicines: list = field(default_factory=list)
+    precautions: list = field(default_factory=list)
+    locations: list = field(default_factory=list)
+
+    def sections(self):
+        """Yield (header, items) for each non-empty section in display order"""
+        for header in SECTION_HEADERS:
+            items = getattr(self, SECTION_FIELDS[header])
+            if items:
+                yield header, items
+
+    def to_dict(self):
+        return asdict(self)
+
+def match_strict_header(line):
+    """Return the section header contained in a line, or None"""
+    match = STRICT_HEADER_PATTERN.search(line)
+    return match.group(0) if match else None
+
+def match_loose_header(line):
+    """Guess which section an unstructured heading line introduces, or None"""
+    line_lower = line.lower()
+    for header, pattern in LOOSE_HEADER_PATTERNS:
+        if pattern.search(line_lower):
+            return header
+    return None
+
+def clean_item(line):
+    return line.strip('- ').strip()
+
+def parse_response(response_text, strict=None):
+    """Parse model output into a MedicalResponse in a single pass over its lines.
+
+    Text that starts with our POSSIBLE MEDICINES: header is parsed strictly on the exact
+    section headers. Anything else is treated as unstructured, headers are guessed from
+    keywords and empty sections are filled with generic advice.
+    """
+    if strict is None:
+        strict = response_text.startswith("POSSIBLE MEDICINES:")
+    match_header = match_strict_header if strict else match_loose_header
+
+    parsed = MedicalResponse()
+    current_items = None
+    for line in response_text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        header = match_header(line)
+        if header:
+            current_items = getattr(parsed, SECTION_FIELDS[header])
+            continue
+        if current_items is not None:
+            cleaned_line = clean_item(line)
+            if cleaned_line:
+                current_items.append(cleaned_line)
+
+    if not strict:
+        for header, items in DEFAULT_SECTION_ITEMS.items():
+            field_name = SECTION_FIELDS[header]
+            if not getattr(parsed, field_name):
+                setattr(parsed, field_name, list(items))
+    return parsed
+
+class SectionStreamParser:
+    """Incrementally split streamed model text into completed response sections"""
+
+    def __init__(self):
+        self.buffer = ""
+        self.current_section = None
+        self.section_content = []
+        self.emitted = []
+
+    def _complete_current(self):
+        completed = []
+        if self.current_section and self.section_content:
+            completed.append((self.current_section, self.section_content))
+            self.emitted.append(self.current_section)
+        self.section_content = []
+        return completed
+
+    def _feed_line(self, line):
+        line = line.strip()
+        if not line:
+            return []
+        header = match_strict_header(line)
+        if header:
+            completed = self._complete_current()
+            self.current_section = header
+            return completed
+        if self.current_section:
+            cleaned_line = clean_item(line)
+            if cleaned_line:
+                self.section_content.append(cleaned_line)
+        return []
+
+    def feed(self, text):
+        """Add a chunk of text, returning any sections completed by it"""
+        self.buffer += text
+        completed = []
+        while '\n' in self.buffer:
+            line, self.buffer = self.buffer.split('\n', 1)
+            completed.extend(self._feed_line(line))
+        return completed
+
+    def finish(self):
+        """Flush the remaining text and fill in any sections the model skipped"""
+        completed = self._feed_line(self.buffer)
+        self.buffer = ""
+        completed.extend(self._complete_current())
+        self.current_section = None
+        if self.emitted:
+            for header, items in DEFAULT_SECTION_ITEMS.items():
+                if header not in self.emitted:
+                    completed.append((header, items))
+                    self.emitted.append(header)
+        return completed
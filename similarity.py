@@ -0,0 +1,245 @@
+import hashlib
+import random
+import threading
+import time
+from array import array
+
+from cache import connect_shared, normalize_symptoms
+from knowledge_base import STOPWORDS, TOKEN_PATTERN, stem
+
+# Smallest prime above 2**32, for the (a * x + b) mod p hash family
+HASH_PRIME = 4294967311
+
+# Form fields that must match exactly before a stored answer can be reused
+SCOPE_FIELDS = ("severity", "duration")
+
+# Kept and merged into the word they negate, so "not allergic" is a different word from "allergic"
+NEGATIONS = frozenset("no not never without cant cannot dont doesnt didnt isnt wasnt arent havent wont nor".split())
+
+def symptom_words(text):
+    """Content words of text, with a negation fused onto the next one ("not_allergic")"""
+    words = []
+    negated = False
+    # Drop apostrophes first so "can't" and "don't" tokenize as one negation word
+    for token in TOKEN_PATTERN.findall(text.replace("'", "").replace("\u2019", "")):
+        if token in NEGATIONS:
+            negated = True
+        elif token not in STOPWORDS:
+            words.append(f"not_{stem(token)}" if negated else stem(token))
+            negated = False
+    return words
+
+def shingle_prompt(prompt):
+    """Split a prompt into its symptom word shingles and a scope of exact-match form fields and negations"""
+    scope = {}
+    text_lines = []
+    for line in normalize_symptoms(prompt).split('\n'):
+        key, _, value = line.partition(':')
+        if key in SCOPE_FIELDS:
+            scope[key] = value.strip()
+        else:
+            text_lines.append(line)
+    # Single words rather than n-grams, so the same symptoms listed in another order still match
+    shingles = set(symptom_words(' '.join(text_lines)))
+    scope_key = '|'.join(f"{field}={scope.get(field, '')}" for field in SCOPE_FIELDS)
+    # What is denied has to match exactly too: one flipped word barely moves the overall similarity
+    negated = sorted(shingle for shingle in shingles if shingle.startswith("not_"))
+    if negated:
+        scope_key += '|' + ','.join(negated)
+    return shingles, scope_key
+
+def hash_shingle(shingle):
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little')
+
+class SimilarityCache:
+    """Reuse answers for near-duplicate prompts, found with MinHash signatures and LSH banding.
+
+    Signatures live in memory in one flat array; responses stay in SQLite and are only read
+    on a hit. Entries are scoped by provider and by the Severity/Duration form fields, so
+    only prompts with identical fields can share an answer. Rows added by other worker
+    processes sharing the SQLite file are picked up at most sync_interval seconds later.
+    """
+
+    def __init__(self, db_path=":memory:", threshold=0.8, num_perm=32, bands=8,
+                 max_entries=100000, ttl_seconds=24 * 60 * 60, max_candidates=256, seed=1,
+                 sync_interval=1.0):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Bounds lookup time when a very common prompt fills up a bucket
+        self.max_candidates = max_candidates
+        self.sync_interval = sync_interval
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, HASH_PRIME), rng.randrange(0, HASH_PRIME)) for _ in range(num_perm)]
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._reset_index()
+
+        self.conn = connect_shared(db_path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS similarity_cache (
+                id INTEGER PRIMARY KEY,
+                scope TEXT NOT NULL,
+                signature BLOB NOT NULL,
+                response TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )"""
+        )
+        self.conn.execute("DELETE FROM similarity_cache WHERE created_at < ?", (time.time() - ttl_seconds,))
+        self.conn.commit()
+        with self.lock:
+            self._sync(force=True)
+
+    def _reset_index(self):
+        # Slot i holds signatures[i * num_perm:(i + 1) * num_perm]; a row id of 0 marks an evicted slot
+        self.signatures = array('I')
+        self.row_ids = array('q')
+        self.scopes = []
+        self.buckets = {}
+        self.oldest_slot = 0
+        self.live_entries = 0
+        self.last_row_id = 0
+        self.synced_at = 0.0
+
+    def signature(self, shingles):
+        hashes = [hash_shingle(shingle) for shingle in shingles]
+        return array('I', (
+            min((a * h + b) % HASH_PRIME for h in hashes) & 0xFFFFFFFF
+            for a, b in self.permutations
+        ))
+
+    def _band_keys(self, scope, signature):
+        rows = self.rows
+        return [
+            hash((scope, band) + tuple(signature[band * rows:(band + 1) * rows]))
+            for band in range(self.bands)
+        ]
+
+    def _sync(self, force=False):
+        """Index rows written since the last sync, by this process or another one"""
+        now = time.time()
+        if not force and now - self.synced_at < self.sync_interval:
+            return
+        self.synced_at = now
+        for row_id, scope, signature in self.conn.execute(
+            "SELECT id, scope, signature FROM similarity_cache WHERE id > ? ORDER BY id", (self.last_row_id,)
+        ):
+            self._index(row_id, scope, array('I', signature))
+        self._evict_overflow()
+
+    def _index(self, row_id, scope, signature):
+        slot = len(self.row_ids)
+        self.last_row_id = max(self.last_row_id, row_id)
+        self.signatures.extend(signature)
+        self.row_ids.append(row_id)
+        self.scopes.append(scope)
+        for key in self._band_keys(scope, signature):
+            self.buckets.setdefault(key, []).append(slot)
+        self.live_entries += 1
+
+    def _evict_overflow(self):
+        evicted = []
+        while self.live_entries > self.max_entries:
+            row_id = self.row_ids[self.oldest_slot]
+            if row_id:
+                evicted.append((row_id,))
+                self.row_ids[self.oldest_slot] = 0
+                self.live_entries -= 1
+                self.evictions += 1
+            self.oldest_slot += 1
+        if evicted:
+            self.conn.executemany("DELETE FROM similarity_cache WHERE id = ?", evicted)
+            self.conn.commit()
+        # Rebuild once evicted slots make up half of the index
+        if self.oldest_slot > self.max_entries:
+            self._compact()
+
+    def _compact(self):
+        signatures, row_ids, scopes = self.signatures, self.row_ids, self.scopes
+        self._reset_index()
+        for slot, row_id in enumerate(row_ids):
+            if row_id:
+                start = slot * self.num_perm
+                self._index(row_id, scopes[slot], signatures[start:start + self.num_perm])
+
+    def _similarity(self, signature, slot):
+        start = slot * self.num_perm
+        stored = self.signatures[start:start + self.num_perm]
+        return sum(1 for x, y in zip(signature, stored) if x == y) / self.num_perm
+
+    def lookup(self, provider, prompt):
+        """Return (similarity, response) for the closest stored prompt above the threshold, or None"""
+        shingles, scope = shingle_prompt(prompt)
+        if not shingles:
+            return None
+        scope = f"{provider}|{scope}"
+        signature = self.signature(shingles)
+        with self.lock:
+            self._sync()
+            best_slot, best_similarity = None, 0.0
+            seen = set()
+            for key in self._band_keys(scope, signature):
+                # Newest entries first, they are the most likely to still be fresh
+                for slot in reversed(self.buckets.get(key, ())):
+                    if len(seen) >= self.max_candidates:
+                        break
+                    if slot in seen or not self.row_ids[slot] or self.scopes[slot] != scope:
+                        continue
+                    seen.add(slot)
+                    similarity = self._similarity(signature, slot)
+                    if similarity > best_similarity:
+                        best_slot, best_similarity = slot, similarity
+
+            row = None
+            if best_slot is not None and best_similarity >= self.threshold:
+                row = self.conn.execute(
+                    "SELECT response, created_at FROM similarity_cache WHERE id = ?",
+                    (self.row_ids[best_slot],)
+                ).fetchone()
+            if row is None or time.time() - row[1] > self.ttl_seconds:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return best_similarity, row[0]
+
+    def get(self, provider, prompt):
+        """Return a stored response for a near-duplicate prompt, or None"""
+        match = self.lookup(provider, prompt)
+        return match[1] if match else None
+
+    def add(self, provider, prompt, response):
+        shingles, scope = shingle_prompt(prompt)
+        if not shingles:
+            return
+        scope = f"{provider}|{scope}"
+        signature = self.signature(shingles)
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO similarity_cache (scope, signature, response, created_at) VALUES (?, ?, ?, ?)",
+                (scope, signature.tobytes(), response, time.time())
+            )
+            self.conn.commit()
+            # Sync rather than index directly, so rows other workers wrote first are not skipped
+            self._sync(force=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': self.live_entries,
+                'threshold': self.threshold
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+import uuid
+
+from cache import connect_shared
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one shared upstream call"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.timed_out = 0
+
+    def do(self, key, fn, timeout=None, default=None):
+        """Run fn() once per key at a time; concurrent callers with the same key share its result.
+
+        A caller that finds the call already running waits at most timeout seconds for it,
+        then gives up and returns default.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self.calls[key] = call
+                self.leaders += 1
+                leader = True
+
+        if not leader:
+            if not call.done.wait(timeout):
+                with self.lock:
+                    self.timed_out += 1
+                return default
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+        return call.result
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'inFlight': len(self.calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'timedOut': self.timed_out
+            }
+
+class SharedFlight:
+    """Coalesce identical calls across worker processes with leases in a shared SQLite file.
+
+    The worker that takes the lease for a key makes the call; the others poll wait_for(),
+    typically a lookup in the shared response cache, until the answer appears or the lease
+    is released or expires, and only then make the call themselves.
+    """
+
+    def __init__(self, db_path, lease_seconds=60, poll_interval=0.05):
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self.lock = threading.Lock()
+        self.leaders = 0
+        self.coalesced = 0
+        self.fell_back = 0
+        self.conn = connect_shared(db_path)
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS inflight (
+                key TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )"""
+        )
+        self.conn.commit()
+
+    def _acquire(self, key):
+        now = time.time()
+        with self.lock:
+            # A lease left behind by a crashed worker stops counting once it expires
+            self.conn.execute("DELETE FROM inflight WHERE key = ? AND expires_at < ?", (key, now))
+            cursor = self.conn.execute(
+                "INSERT OR IGNORE INTO inflight (key, owner, expires_at) VALUES (?, ?, ?)",
+                (key, self.owner, now + self.lease_seconds)
+            )
+            self.conn.commit()
+            return cursor.rowcount == 1
+
+    def _release(self, key):
+        with self.lock:
+            self.conn.execute("DELETE FROM inflight WHERE key = ? AND owner = ?", (key, self.owner))
+            self.conn.commit()
+
+    def _held(self, key):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT 1 FROM inflight WHERE key = ? AND expires_at >= ?", (key, time.time())
+            ).fetchone() is not None
+
+    def do(self, key, fn, wait_for, timeout=None):
+        """Run fn() unless another worker is already running it for key, then return wait_for()'s result.
+
+        A follower waits at most timeout seconds (and never past the lease) before running fn() itself.
+        """
+        if self._acquire(key):
+            with self.lock:
+                self.leaders += 1
+            try:
+                return fn()
+            finally:
+                self._release(key)
+
+        deadline = time.time() + (self.lease_seconds if timeout is None else min(timeout, self.lease_seconds))
+        while time.time() < deadline:
+            time.sleep(self.poll_interval)
+            # Check the lease first: once it is gone, the leader's answer is already stored
+            held = self._held(key)
+            result = wait_for()
+            if result is not None:
+                with self.lock:
+                    self.coalesced += 1
+                return result
+            if not held:
+                # The other worker finished without an answer we can reuse
+                break
+        with self.lock:
+            self.fell_back += 1
+        return fn()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'fellBack': self.fell_back
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
@@ -0,0 +1,98 @@
+import json
+import re
+from bisect import bisect_right
+
+# Labels of the detailed symptom form; a message containing one already has the details
+DETAIL_MARKERS = ("Duration:", "Severity:", "Pattern:", "Original symptoms:")
+
+# Joins messages for a batch scan; not a word or whitespace character, so no match can span two messages
+BATCH_SEPARATOR = "\x00"
+
+def normalize_term(term):
+    return ' '.join(term.lower().split())
+
+def trie_pattern(terms):
+    """Build a regex alternation of the terms with shared prefixes factored out.
+
+    A flat "a|b|c" alternation is retried term by term at every position; the trie form
+    lets the regex engine rule out most terms after their first character.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in term:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return _node_pattern(trie)
+
+def _node_pattern(node):
+    ends_here = '' in node
+    alternatives = [
+        (r'\s+' if char == ' ' else re.escape(char)) + _node_pattern(child)
+        for char, child in sorted(node.items()) if char
+    ]
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1 and not ends_here:
+        return alternatives[0]
+    group = '(?:' + '|'.join(alternatives) + ')'
+    return group + '?' if ends_here else group
+
+class TriageClassifier:
+    """Decide whether a symptom message is too vague to answer, with one compiled word-boundary regex"""
+
+    def __init__(self, vague_terms, detail_markers=DETAIL_MARKERS, min_words=4):
+        self.vague_terms = sorted({normalize_term(term) for term in vague_terms if term.strip()})
+        self.detail_markers = tuple(detail_markers)
+        self.min_words = min_words
+        # Matched against lowercased text, which is faster than an IGNORECASE pattern
+        self.pattern = re.compile(r'\b(?:' + trie_pattern(self.vague_terms) + r')\b')
+
+    @classmethod
+    def load(cls, *paths):
+        """Load and merge vocabulary files; later files may override detail_markers and min_words"""
+        vague_terms = []
+        options = {}
+        for path in paths:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            vague_terms.extend(data.get('vague_terms', ()))
+            options.update({key: data[key] for key in ('detail_markers', 'min_words') if key in data})
+        return cls(vague_terms, **options)
+
+    def is_detailed(self, text):
+        return any(marker in text for marker in self.detail_markers)
+
+    def needs_more_info(self, text):
+        """True if the message has no form details and is vague or too short"""
+        if self.is_detailed(text):
+            return False
+        return self.pattern.search(text.lower()) is not None or len(text.split()) < self.min_words
+
+    def needs_more_info_batch(self, texts):
+        """Classify many messages with a single regex scan over all of them"""
+        texts = list(texts)
+        # Lowercase each message before joining, since lowercasing can change a string's length
+        lowered = [text.lower() for text in texts]
+        starts = []
+        position = 0
+        for text in lowered:
+            starts.append(position)
+            position += len(text) + len(BATCH_SEPARATOR)
+        joined = BATCH_SEPARATOR.join(lowered)
+        vague = [False] * len(texts)
+        position = 0
+        while True:
+            match = self.pattern.search(joined, position)
+            if match is None:
+                break
+            index = bisect_right(starts, match.start()) - 1
+            vague[index] = True
+            if index + 1 == len(texts):
+                break
+            # One match settles a message, so resume at the next one
+            position = starts[index + 1]
+        return [
+            not self.is_detailed(text) and (is_vague or len(text.split()) < self.min_words)
+            for text, is_vague in zip(texts, vague)
+        ]
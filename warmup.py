@@ -0,0 +1,143 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from dispatch import percentile
+
+logger = logging.getLogger(__name__)
+
+def parse_windows(spec):
+    """Parse "22:00-07:00,12:30-13:00" into (start, end) minutes of the day; windows may wrap midnight"""
+    windows = []
+    for part in filter(None, (part.strip() for part in (spec or '').split(','))):
+        start, end = part.split('-')
+        windows.append(tuple(
+            int(hours) * 60 + int(minutes)
+            for hours, minutes in (value.strip().split(':') for value in (start, end))
+        ))
+    return windows
+
+def in_windows(windows, minute_of_day):
+    for start, end in windows:
+        if start <= end and start <= minute_of_day < end:
+            return True
+        if start > end and (minute_of_day >= start or minute_of_day < end):
+            return True
+    return False
+
+class ModelKeeper:
+    """Preload the Ollama model and keep it resident outside idle windows, tracking cold versus warm latency.
+
+    Every request asks Ollama to keep the model loaded for keep_alive seconds. Outside the
+    idle windows a background thread pings the model shortly before that runs out; inside
+    them requests use idle_keep_alive and no pings are sent, so the model unloads when unused.
+    """
+
+    def __init__(self, client, keep_alive=30 * 60, idle_keep_alive=5 * 60, idle_windows=(),
+                 check_interval=60, cold_load_ms=500, max_samples=1000):
+        self.client = client
+        self.keep_alive = keep_alive
+        self.idle_keep_alive = idle_keep_alive
+        self.idle_windows = list(idle_windows)
+        self.check_interval = check_interval
+        # Requests whose model load took at least this long count as cold
+        self.cold_load_ms = cold_load_ms
+        self.cold_latencies = deque(maxlen=max_samples)
+        self.warm_latencies = deque(maxlen=max_samples)
+        self.load_durations = deque(maxlen=max_samples)
+        self.last_used = 0.0
+        self.last_warmed_at = None
+        self.pings = 0
+        self.ping_failures = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def is_idle_window(self, now=None):
+        local = time.localtime(now)
+        return in_windows(self.idle_windows, local.tm_hour * 60 + local.tm_min)
+
+    def keep_alive_seconds(self):
+        """The keep_alive value to send with a request right now"""
+        return self.idle_keep_alive if self.is_idle_window() else self.keep_alive
+
+    def record(self, latency_ms, load_duration_ns=None):
+        """Record one generate call, using Ollama's load_duration to tell cold from warm"""
+        load_ms = (load_duration_ns or 0) / 1e6
+        latency_ms = round(latency_ms, 1)
+        with self.lock:
+            self.last_used = time.time()
+            self.load_durations.append(round(load_ms, 1))
+            if load_ms >= self.cold_load_ms:
+                self.cold_latencies.append(latency_ms)
+            else:
+                self.warm_latencies.append(latency_ms)
+
+    def warm(self):
+        """Load the model without generating anything; returns Ollama's load time in milliseconds"""
+        keep_alive = self.keep_alive_seconds()
+        response = self.client.generate(
+            {"model": self.client.model, "prompt": "", "stream": False, "keep_alive": keep_alive},
+            timeout=max(120, self.check_interval)
+        )
+        response.raise_for_status()
+        load_ms = response.json().get("load_duration", 0) / 1e6
+        self.mark_warmed(time.time())
+        with self.lock:
+            self.pings += 1
+        return load_ms
+
+    def mark_warmed(self, warmed_at):
+        """Note that the model was loaded at warmed_at, here or by the process that forked this one"""
+        with self.lock:
+            self.last_used = max(self.last_used, warmed_at)
+            self.last_warmed_at = warmed_at
+
+    def needs_ping(self):
+        """Whether the model would unload before the next check unless we touch it"""
+        if self.is_idle_window():
+            return False
+        with self.lock:
+            idle_for = time.time() - self.last_used
+        return idle_for + 2 * self.check_interval >= self.keep_alive
+
+    def run(self, warm_first):
+        if warm_first:
+            self._ping("Warmed up")
+        while not self.stop_event.wait(self.check_interval):
+            if self.needs_ping():
+                self._ping("Kept alive")
+
+    def _ping(self, action):
+        try:
+            load_ms = self.warm()
+            logger.info("%s Ollama model %s (load took %.0f ms)", action, self.client.model, load_ms)
+        except Exception as e:
+            with self.lock:
+                self.ping_failures += 1
+            logger.warning("Ollama keep-alive failed: %s", e)
+
+    def start(self, warm_first=True):
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, args=(warm_first,), name="ollama-keep-alive", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def snapshot(self):
+        with self.lock:
+            cold, warm = list(self.cold_latencies), list(self.warm_latencies)
+            return {
+                'keepAliveSeconds': self.keep_alive_seconds(),
+                'idleWindow': self.is_idle_window(),
+                'lastWarmedAt': self.last_warmed_at,
+                'pings': self.pings,
+                'pingFailures': self.ping_failures,
+                'cold': {'requests': len(cold), 'p50Ms': percentile(cold, 0.50), 'p95Ms': percentile(cold, 0.95)},
+                'warm': {'requests': len(warm), 'p50Ms': percentile(warm, 0.50), 'p95Ms': percentile(warm, 0.95)},
+                'loadP95Ms': percentile(list(self.load_durations), 0.95)
+            }
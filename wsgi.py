@@ -0,0 +1,24 @@
+"""WSGI entry point for pre-forking servers.
+
+    gunicorn --workers 4 --threads 16 --preload wsgi:app
+
+With --preload the app is built once in the master. Apart from loading the Ollama model once
+(and closing that connection again), the master opens no connections and starts no threads:
+every worker creates its own provider clients, caches and background threads on its first
+request (see main.ensure_services), since none of them survive fork. The response
+cache, similarity cache and in-flight leases live in SQLite files under the instance folder,
+so workers share cached answers and coalesce identical questions across processes.
+"""
+from main import create_app, preload_model
+from models import db
+
+app = create_app(start_services=False)
+
+# One synchronous warm-up here, so the first request to each worker does not pay the model load
+if app.config['OLLAMA_WARMUP']:
+    preload_model(app)
+
+with app.app_context():
+    db.create_all()
+    # Close the connection create_all opened, so no worker inherits it
+    db.engine.dispose()